@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Генератор синтетической uroboros.db для бенчмарков миграции.
+
+Схема SQLite восстановлена по запросам скриптов миграции (STAGING_SOURCES
+в final_script.py, таблицы main.py). Масштаб задаётся числом строк changes —
+самой большой таблицы; остальные таблицы растут пропорционально:
+
+    vulnerabilities   rows / 10
+    src_packages      rows / 50
+    pkg_versions      rows / 5
+    assemblies        rows / 1000
+    asm_pkg_vsn_lnk   2 * pkg_versions
+    chg_vln_lnk       ~ 0.6 * rows (у ~30% changes в тексте 1-3 CVE)
+
+Пример:
+    python benchmarks/generate_uroboros.py --rows 100000 --output /tmp/uroboros_100k.db
+"""
+
+import argparse
+import logging
+import os
+import random
+import sqlite3
+import sys
+import time
+from itertools import islice
+
+# Размер пачки executemany
+INSERT_BATCH_SIZE = 50000
+
+# Фиксированные справочники
+URGENCY_NAMES = ['low', 'medium', 'high', 'emergency', 'critical']
+PUBLISHERS_COUNT = 20
+PROJECTS_COUNT = 100
+
+# Доля changes, в тексте которых упоминаются CVE
+CVE_CHANGE_RATIO = 0.3
+
+SQLITE_SCHEMA = [
+    "CREATE TABLE publishers (id INTEGER PRIMARY KEY, name TEXT)",
+    """CREATE TABLE projects (
+        id INTEGER PRIMARY KEY,
+        name TEXT,
+        rls_ref INTEGER,
+        description TEXT,
+        pbr_ref INTEGER,
+        arc_ref INTEGER
+    )""",
+    """CREATE TABLE assemblies (
+        id INTEGER PRIMARY KEY,
+        time INTEGER,
+        description TEXT,
+        prj_ref INTEGER,
+        pbr_ref INTEGER
+    )""",
+    "CREATE TABLE src_packages (id INTEGER PRIMARY KEY, name TEXT)",
+    """CREATE TABLE pkg_versions (
+        id INTEGER PRIMARY KEY,
+        time INTEGER,
+        maintainer TEXT,
+        src_pkg_ref INTEGER,
+        version TEXT
+    )""",
+    "CREATE TABLE asm_pkg_vsn_lnk (asm_ref INTEGER, pkg_vsn_ref INTEGER)",
+    "CREATE TABLE changes (id INTEGER PRIMARY KEY, pkg_vsn_ref INTEGER, special TEXT)",
+    "CREATE TABLE urgency (id INTEGER PRIMARY KEY, name TEXT)",
+    "CREATE TABLE vulnerabilities (id INTEGER PRIMARY KEY, name TEXT)",
+    "CREATE TABLE chg_vln_lnk (chg_ref INTEGER, vln_ref INTEGER)",
+]
+
+CHANGE_PHRASES = [
+    'Fix build with newer toolchain',
+    'Update translations',
+    'New upstream release',
+    'Rebuild against updated libraries',
+    'Fix memory leak in parser',
+    'Backport patch from upstream',
+    'Drop obsolete dependency',
+    'Update debian/watch',
+]
+
+logger = logging.getLogger('generate_uroboros')
+
+
+def table_sizes(rows):
+    """
+    Размеры таблиц для заданного масштаба (число строк changes).
+    """
+    pkg_versions = max(rows // 5, 20)
+    return {
+        'publishers': PUBLISHERS_COUNT,
+        'projects': PROJECTS_COUNT,
+        'assemblies': max(rows // 1000, 10),
+        'src_packages': max(rows // 50, 10),
+        'pkg_versions': pkg_versions,
+        'asm_pkg_vsn_lnk': pkg_versions * 2,
+        'changes': rows,
+        'urgency': len(URGENCY_NAMES),
+        'vulnerabilities': max(rows // 10, 10),
+    }
+
+
+def cve_name(vuln_id):
+    """
+    Имя CVE для id уязвимости; номер уникален и подходит под CVE-\\d{4}-\\d{4,7}.
+    """
+    return f"CVE-{2000 + vuln_id % 25}-{10000 + vuln_id}"
+
+
+def insert_rows(conn, table, columns, rows):
+    """
+    Вставка строк из генератора пачками по INSERT_BATCH_SIZE.
+
+    :return: Количество вставленных строк.
+    """
+    placeholders = ', '.join('?' for _ in columns)
+    sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})"
+    total = 0
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, INSERT_BATCH_SIZE))
+        if not batch:
+            break
+        conn.executemany(sql, batch)
+        total += len(batch)
+    conn.commit()
+    logger.info(f"{table}: {total} строк")
+    return total
+
+
+def generate(path, rows, seed):
+    """
+    Создаёт файл SQLite с синтетическими данными заданного масштаба.
+    """
+    rnd = random.Random(seed)
+    sizes = table_sizes(rows)
+    if os.path.exists(path):
+        os.remove(path)
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+    for ddl in SQLITE_SCHEMA:
+        conn.execute(ddl)
+
+    base_time = 1262304000  # 2010-01-01
+
+    insert_rows(conn, 'publishers', ('id', 'name'), (
+        (i, f"publisher-{i}") for i in range(1, sizes['publishers'] + 1)
+    ))
+    insert_rows(conn, 'projects', ('id', 'name', 'rls_ref', 'description', 'pbr_ref', 'arc_ref'), (
+        (i, f"project-{i}", rnd.randint(1, 10), f"Synthetic project {i}",
+         rnd.randint(1, sizes['publishers']), rnd.randint(1, 4))
+        for i in range(1, sizes['projects'] + 1)
+    ))
+    insert_rows(conn, 'assemblies', ('id', 'time', 'description', 'prj_ref', 'pbr_ref'), (
+        (i, base_time + i * 3600, f"Assembly {i}" if i % 7 else None,
+         rnd.randint(1, sizes['projects']), rnd.randint(1, sizes['publishers']))
+        for i in range(1, sizes['assemblies'] + 1)
+    ))
+    insert_rows(conn, 'src_packages', ('id', 'name'), (
+        (i, f"pkg{i}") for i in range(1, sizes['src_packages'] + 1)
+    ))
+
+    def iter_pkg_versions():
+        # Версии нумеруются внутри пакета, пара (version, src_pkg_ref) уникальна
+        next_version = {}
+        for i in range(1, sizes['pkg_versions'] + 1):
+            src_pkg = rnd.randint(1, sizes['src_packages'])
+            n = next_version.get(src_pkg, 0) + 1
+            next_version[src_pkg] = n
+            yield (i, base_time + i * 60 if i % 50 else 0, f"Maintainer {i % 500} <m{i % 500}@example.org>",
+                   src_pkg, f"{n // 10}.{n % 10}-{rnd.randint(1, 5)}")
+
+    insert_rows(conn, 'pkg_versions', ('id', 'time', 'maintainer', 'src_pkg_ref', 'version'), iter_pkg_versions())
+
+    def iter_asm_links():
+        # Каждая версия пакета входит в две разные сборки
+        for pkg_vsn in range(1, sizes['pkg_versions'] + 1):
+            first = rnd.randint(1, sizes['assemblies'])
+            second = first % sizes['assemblies'] + 1
+            yield (first, pkg_vsn)
+            yield (second, pkg_vsn)
+
+    insert_rows(conn, 'asm_pkg_vsn_lnk', ('asm_ref', 'pkg_vsn_ref'), iter_asm_links())
+    insert_rows(conn, 'urgency', ('id', 'name'), enumerate(URGENCY_NAMES, start=1))
+    insert_rows(conn, 'vulnerabilities', ('id', 'name'), (
+        (i, cve_name(i)) for i in range(1, sizes['vulnerabilities'] + 1)
+    ))
+
+    # changes и chg_vln_lnk генерируются вместе: ссылки соответствуют CVE в тексте
+    links = []
+
+    def iter_changes():
+        for i in range(1, rows + 1):
+            lines = [f"  * {rnd.choice(CHANGE_PHRASES)}." for _ in range(rnd.randint(1, 4))]
+            if rnd.random() < CVE_CHANGE_RATIO:
+                vuln_ids = rnd.sample(range(1, sizes['vulnerabilities'] + 1), rnd.randint(1, 3))
+                for vuln_id in vuln_ids:
+                    lines.append(f"  * Security fix for {cve_name(vuln_id)}.")
+                    links.append((i, vuln_id))
+            yield (i, rnd.randint(1, sizes['pkg_versions']), '\n'.join(lines))
+
+    changes = iter_changes()
+    total_links = 0
+    while True:
+        batch = list(islice(changes, INSERT_BATCH_SIZE))
+        if not batch:
+            break
+        insert_rows(conn, 'changes', ('id', 'pkg_vsn_ref', 'special'), batch)
+        total_links += insert_rows(conn, 'chg_vln_lnk', ('chg_ref', 'vln_ref'), links)
+        links.clear()
+    conn.close()
+    sizes['chg_vln_lnk'] = total_links
+    return sizes
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Генерация синтетической uroboros.db")
+    parser.add_argument('--rows', type=int, default=10000,
+                        help="Масштаб: число строк changes (от 10k до 10M)")
+    parser.add_argument('--output', required=True, help="Путь к создаваемому файлу SQLite")
+    parser.add_argument('--seed', type=int, default=42, help="Seed генератора случайных чисел")
+    return parser.parse_args()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s',
+                        stream=sys.stdout)
+    args = parse_args()
+    started = time.perf_counter()
+    sizes = generate(args.output, args.rows, args.seed)
+    logger.info(f"Создан {args.output} за {time.perf_counter() - started:.1f} с: {sizes}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,424 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк пайплайнов миграции на синтетической uroboros.db.
+
+Для каждого масштаба генерирует (или берёт из кэша) SQLite-файл через
+generate_uroboros.py. Каждый пайплайн запускается отдельным процессом во
+временной базе PostgreSQL: база создаётся, наполняется схемой schema.sql и
+удаляется после запуска. Скриптам передаются переменные окружения MIGRATION_*,
+после запуска читается их JSON-сводка этапов (stage_metrics.py).
+
+fixed_cve_table_fill.py работает по уже заполненной схеме repositories, поэтому
+перед ним в той же базе выполняется final_script.py (без учёта в отчёте), а
+debtracker заполняется из той же синтетической базы. Режимы --workers, --pushdown
+и --incremental замеряются отдельными пайплайнами fixed_cve_*.
+
+Успешность запуска определяется по JSON-сводке этапов (см. PIPELINES['expect']),
+а не по коду возврата.
+
+Результаты печатаются таблицей и сохраняются в JSON. С --baseline сравнивает
+rows_per_sec по этапам с прошлым прогоном и завершается с кодом 1, если
+какой-либо этап замедлился сильнее --tolerance или пайплайн не прошёл проверку сводки.
+
+benchmarks/baseline.json — записанный прогон всех пайплайнов на масштабах 10000 и 100000
+(PostgreSQL 16.2 на той же машине, Python 3.11, 1 CPU); все пайплайны прошли проверку
+сводки. Абсолютные значения зависят от машины: на другой машине сначала запишите свой
+baseline через --output.
+
+Пример:
+    python benchmarks/run_benchmarks.py --rows 10000 100000 --output bench.json
+    python benchmarks/run_benchmarks.py --rows 10000 100000 --baseline bench.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import subprocess
+import sys
+import time
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+SCHEMA_PATH = os.path.join(BENCH_DIR, 'schema.sql')
+GENERATOR_PATH = os.path.join(BENCH_DIR, 'generate_uroboros.py')
+
+# Пайплайны: скрипт и его аргументы, файл JSON-сводки, пайплайн-предусловие в той же базе,
+# прогрев (тот же запуск до замера, например для состояния --incremental) и ожидаемые этапы:
+# {этап: минимальное число строк}. Запуск успешен, только если все ожидаемые этапы есть
+# в сводке, набрали строки и ни один этап не завершился исключением — код возврата
+# не показателен (fixed_cve_table_fill.py перехватывает исключения и завершается с 0).
+FIXED_CVE_EXPECT = {'load_reference_data': 1, 'scan_changelog': 1, 'debtracker': 1, 'upsert': 1}
+PIPELINES = {
+    'main': {
+        'script': 'main.py',
+        'metrics': 'db_migration_metrics.json',
+        'expect': {
+            'urgency': 1, 'vulnerabilities': 1, 'package': 1, 'project': 1, 'assembly': 1,
+            'pkg_version': 1, 'changelog': 1, 'assm_pkg_vrs': 1, 'chg_vln_lnk': 0,
+        },
+    },
+    'temp': {
+        'script': 'temp.py',
+        'metrics': 'migration_full_metrics.json',
+        'expect': {
+            'staging:changes': 1, 'create_id_mappings': 0, 'process:projects': 1, 'process:assemblies': 1,
+            'process:src_packages': 1, 'process:pkg_versions': 1, 'process:urgency': 1,
+            'process:vulnerabilities': 1, 'process:assm_pkg_vrs': 1, 'process:changes': 1,
+        },
+    },
+    'final_script': {
+        'script': 'final_script.py',
+        'metrics': 'migration_incremental_metrics.json',
+        'expect': {
+            'staging_load': 1, 'process:projects': 1, 'process:assemblies': 1, 'process:src_packages': 1,
+            'process:pkg_versions': 1, 'process:urgency': 1, 'process:vulnerabilities': 1,
+            'process:assm_pkg_vrs': 1, 'process:changes': 1,
+        },
+    },
+    'fixed_cve': {
+        'script': 'fixed_cve_table_fill.py',
+        'metrics': 'fixed_cve_metrics.json',
+        'requires': 'final_script',
+        'expect': FIXED_CVE_EXPECT,
+    },
+    'fixed_cve_workers': {
+        'script': 'fixed_cve_table_fill.py',
+        'args': ['--workers', str(os.cpu_count() or 1)],
+        'metrics': 'fixed_cve_metrics.json',
+        'requires': 'final_script',
+        'expect': FIXED_CVE_EXPECT,
+    },
+    'fixed_cve_pushdown': {
+        'script': 'fixed_cve_table_fill.py',
+        'args': ['--pushdown'],
+        'metrics': 'fixed_cve_metrics.json',
+        'requires': 'final_script',
+        'expect': {'pushdown_upsert': 1},
+    },
+    # Замеряется повторный запуск без изменений: стоимость определения дельты
+    'fixed_cve_incremental': {
+        'script': 'fixed_cve_table_fill.py',
+        'args': ['--incremental', '--pushdown'],
+        'metrics': 'fixed_cve_metrics.json',
+        'requires': 'final_script',
+        'warmup': True,
+        'expect': {'incremental_scope': 0},
+    },
+}
+
+# Размер пачки при заполнении debtracker
+DEBTRACKER_BATCH_SIZE = 10000
+
+logger = logging.getLogger('run_benchmarks')
+
+
+def pg_params(args, dbname):
+    return {
+        'dbname': dbname,
+        'user': args.pg_user,
+        'password': args.pg_password,
+        'host': args.pg_host,
+        'port': args.pg_port,
+    }
+
+
+def pipeline_env(args, sqlite_path, dbname):
+    """
+    Переменные окружения, которыми скрипты переопределяют свои настройки подключения.
+    """
+    env = dict(os.environ)
+    env.update({
+        'MIGRATION_SQLITE_DB': sqlite_path,
+        'MIGRATION_PG_DBNAME': dbname,
+        'MIGRATION_PG_USER': args.pg_user,
+        'MIGRATION_PG_PASSWORD': args.pg_password,
+        'MIGRATION_PG_HOST': args.pg_host,
+        'MIGRATION_PG_PORT': str(args.pg_port),
+        'MIGRATION_PG_URL': (
+            f"postgresql+psycopg2://{args.pg_user}:{args.pg_password}"
+            f"@{args.pg_host}:{args.pg_port}/{dbname}"
+        ),
+    })
+    return env
+
+
+def ensure_sqlite_db(workdir, rows, seed):
+    """
+    Путь к синтетической базе заданного масштаба; генерирует её, если файла ещё нет.
+    """
+    path = os.path.join(workdir, f"uroboros_{rows}.db")
+    if os.path.exists(path):
+        logger.info(f"Используется готовая синтетическая база {path}")
+        return path
+    logger.info(f"Генерация синтетической базы {path} ({rows} строк changes)")
+    subprocess.run(
+        [sys.executable, GENERATOR_PATH, '--rows', str(rows), '--output', path, '--seed', str(seed)],
+        check=True,
+    )
+    return path
+
+
+def create_database(args, dbname):
+    """
+    Создаёт временную базу и применяет schema.sql.
+    """
+    admin = psycopg2.connect(**pg_params(args, args.pg_admin_db))
+    admin.autocommit = True
+    try:
+        with admin.cursor() as cur:
+            cur.execute(f'DROP DATABASE IF EXISTS "{dbname}"')
+            cur.execute(f'CREATE DATABASE "{dbname}"')
+    finally:
+        admin.close()
+    conn = psycopg2.connect(**pg_params(args, dbname))
+    try:
+        with conn.cursor() as cur, open(SCHEMA_PATH, encoding='utf-8') as f:
+            cur.execute(f.read())
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def drop_database(args, dbname):
+    admin = psycopg2.connect(**pg_params(args, args.pg_admin_db))
+    admin.autocommit = True
+    try:
+        with admin.cursor() as cur:
+            cur.execute(f'DROP DATABASE IF EXISTS "{dbname}"')
+    finally:
+        admin.close()
+
+
+def seed_debtracker(args, dbname, sqlite_path):
+    """
+    Заполняет debtracker из синтетической базы: пакеты, версии, CVE и исправления
+    для связей chg_vln_lnk каждой второй записи changes.
+    """
+    sources = [
+        ('debtracker.package (pkg_id, pkg_name)', "SELECT id, name FROM src_packages"),
+        ('debtracker.pkg_version (pkg_vrs_id, version, pkg_id)',
+         "SELECT id, version, src_pkg_ref FROM pkg_versions"),
+        ('debtracker.cve (cve_id, cve_name)', "SELECT id, name FROM vulnerabilities"),
+        ('debtracker.cve_rep (cve_id, fixed_pkg_vrs_id)', """
+            SELECT l.vln_ref, c.pkg_vsn_ref
+            FROM chg_vln_lnk l
+            JOIN changes c ON c.id = l.chg_ref
+            WHERE l.chg_ref % 2 = 0
+        """),
+    ]
+    sqlite_conn = sqlite3.connect(sqlite_path)
+    conn = psycopg2.connect(**pg_params(args, dbname))
+    try:
+        with conn.cursor() as cur:
+            for target, query in sources:
+                sqlite_cur = sqlite_conn.execute(query)
+                while True:
+                    rows = sqlite_cur.fetchmany(DEBTRACKER_BATCH_SIZE)
+                    if not rows:
+                        break
+                    execute_values(cur, f"INSERT INTO {target} VALUES %s", rows, page_size=DEBTRACKER_BATCH_SIZE)
+        conn.commit()
+    finally:
+        conn.close()
+        sqlite_conn.close()
+
+
+def check_result(pipeline, result):
+    """
+    Проблемы запуска по его сводке: ненулевой код возврата, отсутствие сводки, этапы,
+    завершившиеся исключением, отсутствующие ожидаемые этапы или этапы без строк.
+    """
+    problems = []
+    if result['returncode'] != 0:
+        problems.append(f"код возврата {result['returncode']}")
+    summary = result['summary']
+    if not summary:
+        problems.append("нет JSON-сводки этапов")
+        return problems
+    stages = {stage['stage']: stage for stage in summary['stages']}
+    for name, stage in stages.items():
+        if stage.get('errors'):
+            problems.append(f"этап {name} завершился ошибкой")
+    for name, min_rows in pipeline['expect'].items():
+        stage = stages.get(name)
+        if stage is None:
+            problems.append(f"нет этапа {name}")
+        elif stage['rows'] < min_rows:
+            problems.append(f"этап {name}: строк {stage['rows']}, ожидалось не меньше {min_rows}")
+    return problems
+
+
+def run_script(name, run_dir, env, timeout):
+    """
+    Запускает скрипт пайплайна в run_dir (туда же пишутся его логи и JSON-сводка)
+    и проверяет сводку этапов (check_result).
+
+    :return: Словарь с признаком ok, проблемами, кодом возврата, временем и сводкой этапов.
+    """
+    pipeline = PIPELINES[name]
+    metrics_path = os.path.join(run_dir, pipeline['metrics'])
+    if os.path.exists(metrics_path):
+        os.remove(metrics_path)
+    started = time.perf_counter()
+    try:
+        completed = subprocess.run(
+            [sys.executable, os.path.join(REPO_DIR, pipeline['script'])] + pipeline.get('args', []),
+            cwd=run_dir, env=env, timeout=timeout,
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True,
+        )
+        returncode = completed.returncode
+        stderr = completed.stderr
+    except subprocess.TimeoutExpired:
+        returncode = None
+        stderr = f"Превышен таймаут {timeout} с"
+    result = {
+        'returncode': returncode,
+        'wall_time': round(time.perf_counter() - started, 3),
+        'summary': None,
+    }
+    if os.path.exists(metrics_path):
+        with open(metrics_path, encoding='utf-8') as f:
+            result['summary'] = json.load(f)
+    result['problems'] = check_result(pipeline, result)
+    result['ok'] = not result['problems']
+    if not result['ok']:
+        result['stderr_tail'] = (stderr or '')[-2000:]
+        logger.error(f"{name}: {'; '.join(result['problems'])}, см. логи в {run_dir}")
+    return result
+
+
+def run_pipeline(args, name, rows, sqlite_path):
+    """
+    Прогон одного пайплайна во временной базе PostgreSQL.
+    """
+    dbname = f"uroboros_bench_{os.getpid()}"
+    run_dir = os.path.join(args.workdir, str(rows), name)
+    os.makedirs(run_dir, exist_ok=True)
+    env = pipeline_env(args, sqlite_path, dbname)
+    create_database(args, dbname)
+    try:
+        required = PIPELINES[name].get('requires')
+        if required:
+            seed_debtracker(args, dbname, sqlite_path)
+            logger.info(f"{name}: подготовка базы запуском {required}")
+            prepared = run_script(required, run_dir, env, args.timeout)
+            if not prepared['ok']:
+                return dict(prepared, failed_requirement=required)
+        if PIPELINES[name].get('warmup'):
+            logger.info(f"{name}: прогревочный запуск")
+            warmup = run_script(name, run_dir, env, args.timeout)
+            if not warmup['ok']:
+                return dict(warmup, failed_warmup=True)
+        logger.info(f"{name}: запуск на масштабе {rows}")
+        return run_script(name, run_dir, env, args.timeout)
+    finally:
+        if not args.keep_databases:
+            drop_database(args, dbname)
+
+
+def print_report(results):
+    header = f"{'rows':>9} {'pipeline':<21} {'stage':<32} {'rows':>10} {'wall, s':>9} {'rows/s':>11} {'RSS, MB':>8}"
+    print(header)
+    print('-' * len(header))
+    for scale, pipelines in results.items():
+        for name, result in pipelines.items():
+            summary = result.get('summary')
+            if not result['ok']:
+                print(f"{scale:>9} {name:<21} FAILED: {'; '.join(result['problems'])}")
+            if not summary:
+                continue
+            for stage in summary['stages']:
+                rows_per_sec = stage['rows_per_sec'] if stage['rows_per_sec'] is not None else '-'
+                print(f"{scale:>9} {name:<21} {stage['stage']:<32} {stage['rows']:>10} "
+                      f"{stage['wall_time']:>9} {rows_per_sec:>11} {stage['peak_rss_mb']:>8}")
+            print(f"{scale:>9} {name:<21} {'total':<32} {'':>10} {summary['wall_time']:>9} "
+                  f"{'':>11} {summary['peak_rss_mb']:>8}")
+
+
+def find_regressions(results, baseline, tolerance):
+    """
+    Этапы, у которых rows_per_sec упал больше чем на tolerance относительно baseline.
+    """
+    regressions = []
+    for scale, pipelines in results.items():
+        for name, result in pipelines.items():
+            base_result = baseline.get(scale, {}).get(name)
+            if not base_result or not base_result.get('summary') or not result.get('summary'):
+                continue
+            base_stages = {s['stage']: s for s in base_result['summary']['stages']}
+            for stage in result['summary']['stages']:
+                base_stage = base_stages.get(stage['stage'])
+                if not base_stage or not base_stage['rows_per_sec'] or stage['rows_per_sec'] is None:
+                    continue
+                if stage['rows_per_sec'] < base_stage['rows_per_sec'] * (1 - tolerance):
+                    regressions.append(
+                        f"{scale}/{name}/{stage['stage']}: {stage['rows_per_sec']} строк/с "
+                        f"против {base_stage['rows_per_sec']} в baseline"
+                    )
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Бенчмарк пайплайнов миграции на синтетических данных")
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000],
+                        help="Масштабы (число строк changes), например 10000 1000000 10000000")
+    parser.add_argument('--pipelines', nargs='+', choices=list(PIPELINES), default=list(PIPELINES))
+    parser.add_argument('--workdir', default='benchmark_runs',
+                        help="Каталог для синтетических баз, логов и сводок скриптов")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--timeout', type=int, default=None, help="Таймаут одного скрипта, с")
+    parser.add_argument('--output', default=None, help="Файл для JSON с результатами")
+    parser.add_argument('--baseline', default=None, help="JSON прошлого прогона для сравнения")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="Допустимое падение rows_per_sec относительно baseline (доля)")
+    parser.add_argument('--keep-databases', action='store_true', help="Не удалять временные базы")
+    parser.add_argument('--pg-host', default=os.environ.get('MIGRATION_PG_HOST', 'localhost'))
+    parser.add_argument('--pg-port', type=int, default=int(os.environ.get('MIGRATION_PG_PORT', '5432')))
+    parser.add_argument('--pg-user', default=os.environ.get('MIGRATION_PG_USER', 'owner'))
+    parser.add_argument('--pg-password', default=os.environ.get('MIGRATION_PG_PASSWORD', '1111'))
+    parser.add_argument('--pg-admin-db', default='postgres',
+                        help="База для CREATE/DROP DATABASE временных баз")
+    return parser.parse_args()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s',
+                        stream=sys.stdout)
+    args = parse_args()
+    args.workdir = os.path.abspath(args.workdir)
+    os.makedirs(args.workdir, exist_ok=True)
+
+    results = {}
+    for rows in args.rows:
+        sqlite_path = ensure_sqlite_db(args.workdir, rows, args.seed)
+        results[str(rows)] = {
+            name: run_pipeline(args, name, rows, sqlite_path) for name in args.pipelines
+        }
+
+    print_report(results)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        logger.info(f"Результаты записаны в {args.output}")
+
+    failed = [f"{scale}/{name}" for scale, pipelines in results.items()
+              for name, result in pipelines.items() if not result['ok']]
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = find_regressions(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            logger.warning(f"Регрессия: {regression}")
+    if failed:
+        logger.error(f"Пайплайны завершились с ошибкой: {', '.join(failed)}")
+    sys.exit(1 if failed or regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
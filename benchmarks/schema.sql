@@ -0,0 +1,93 @@
+-- Целевая схема PostgreSQL для бенчмарков миграции.
+-- Восстановлена по запросам скриптов; создаются только ограничения, на которые
+-- опираются скрипты (ON CONFLICT по pkg_name, (version, pkg_id) и
+-- (pkg_vrs_id, vulnerability_id)).
+
+CREATE SCHEMA IF NOT EXISTS repositories;
+CREATE SCHEMA IF NOT EXISTS debtracker;
+
+CREATE TABLE repositories.project (
+    prj_id SERIAL PRIMARY KEY,
+    prj_name TEXT NOT NULL,
+    rel_id INTEGER,
+    prj_desc TEXT,
+    vendor TEXT,
+    arch_id INTEGER
+);
+
+CREATE TABLE repositories.assembly (
+    assm_id SERIAL PRIMARY KEY,
+    assm_date_created TIMESTAMP,
+    assm_desc TEXT,
+    prj_id INTEGER,
+    assm_version TEXT
+);
+
+CREATE TABLE repositories.package (
+    pkg_id SERIAL PRIMARY KEY,
+    pkg_name TEXT NOT NULL UNIQUE
+);
+
+CREATE TABLE repositories.pkg_version (
+    pkg_vrs_id SERIAL PRIMARY KEY,
+    pkg_date_created TIMESTAMP,
+    author_name TEXT,
+    pkg_id INTEGER,
+    version TEXT NOT NULL,
+    UNIQUE (version, pkg_id)
+);
+
+CREATE TABLE repositories.assm_pkg_vrs (
+    assm_id INTEGER,
+    pkg_vrs_id INTEGER
+);
+
+CREATE TABLE repositories.urgency (
+    urg_id SERIAL PRIMARY KEY,
+    urg_name TEXT
+);
+
+CREATE TABLE repositories.vulnerabilities (
+    id SERIAL PRIMARY KEY,
+    name TEXT
+);
+
+CREATE TABLE repositories.changelog (
+    id SERIAL PRIMARY KEY,
+    log_desc TEXT,
+    urg_id INTEGER,
+    pkg_vrs_id INTEGER,
+    date_added TIMESTAMP,
+    log_ident TEXT,
+    rep_name TEXT
+);
+
+CREATE TABLE repositories.fixed_cve_status (
+    pkg_vrs_id INTEGER NOT NULL,
+    vulnerability_id INTEGER NOT NULL,
+    changelog_string_number INTEGER,
+    fixed_tracker_string_number INTEGER,
+    manual_input_user_id INTEGER,
+    UNIQUE (pkg_vrs_id, vulnerability_id)
+);
+
+CREATE TABLE debtracker.package (
+    pkg_id INTEGER PRIMARY KEY,
+    pkg_name TEXT
+);
+
+CREATE TABLE debtracker.pkg_version (
+    pkg_vrs_id INTEGER PRIMARY KEY,
+    version TEXT,
+    pkg_id INTEGER
+);
+
+CREATE TABLE debtracker.cve (
+    cve_id INTEGER PRIMARY KEY,
+    cve_name TEXT
+);
+
+CREATE TABLE debtracker.cve_rep (
+    cve_id INTEGER,
+    fixed_pkg_vrs_id INTEGER
+);
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Логирование для массовых запусков миграции.
+
+setup_logging выводит логи через QueueHandler: запись в файл и консоль выполняет
+фоновый поток QueueListener, а не поток миграции.
+
+EventSampler заменяет построчные сообщения счётчиками: по каждой паре
+(таблица, причина) считается число событий и сохраняются первые SAMPLE_LIMIT
+примеров. Сообщения форматируются только при выводе сводки. В подробном режиме
+(bulk=False) каждое событие сразу пишется в лог на уровне DEBUG, как раньше.
+Сэмплируются только информационные события (маппинги); ошибки и отклонённые
+строки пишутся вызывающим кодом на уровне WARNING/ERROR в любом режиме.
+
+Режим задаётся переменной окружения MIGRATION_BULK_LOGGING: по умолчанию 1 (массовый);
+0 включает подробный построчный лог.
+"""
+
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+from collections import Counter
+
+# Массовый режим логирования (по умолчанию включён: построчные DEBUG-события маппинга
+# заменяются сводкой; MIGRATION_BULK_LOGGING=0 возвращает подробный лог)
+BULK_LOGGING = os.environ.get('MIGRATION_BULK_LOGGING', '1') != '0'
+
+# Сколько примеров сохранять для каждой пары (таблица, причина)
+SAMPLE_LIMIT = 5
+
+
+def setup_logging(log_file, stream, log_format, bulk=BULK_LOGGING, background=True):
+    """
+    Настраивает корневой логгер: QueueHandler в потоке миграции и QueueListener,
+    который пишет в файл и в поток stream. В массовом режиме уровень INFO,
+    в подробном — DEBUG.
+
+    background=False подключает обработчики к корневому логгеру напрямую, без потока
+    QueueListener: так настраиваются процессы пула, которые завершаются без atexit.
+
+    :return: Запущенный QueueListener или None при background=False.
+    """
+    formatter = logging.Formatter(log_format)
+    handlers = [logging.FileHandler(log_file), logging.StreamHandler(stream)]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.setLevel(logging.INFO if bulk else logging.DEBUG)
+    if not background:
+        for handler in handlers:
+            root.addHandler(handler)
+        return None
+
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    return listener
+
+
+class EventSampler:
+    """
+    Счётчики и примеры построчных событий по таблицам.
+    Пример — шаблон сообщения с аргументами; строка собирается только в flush.
+    """
+    def __init__(self, logger, bulk=BULK_LOGGING, sample_limit=SAMPLE_LIMIT):
+        self.logger = logger
+        self.bulk = bulk
+        self.sample_limit = sample_limit
+        self.counts = Counter()
+        self.samples = {}
+
+    def record(self, table, reason, msg, *args):
+        """
+        Учитывает одно событие. msg и args — в формате logging (%-подстановка).
+        """
+        if not self.bulk:
+            self.logger.debug(msg, *args)
+            return
+        key = (table, reason)
+        self.counts[key] += 1
+        samples = self.samples.setdefault(key, [])
+        if len(samples) < self.sample_limit:
+            samples.append((msg, args))
+
+    def flush(self, level=logging.INFO):
+        """
+        Выводит сводку по таблицам (число событий и примеры) и сбрасывает счётчики.
+        """
+        for (table, reason), count in sorted(self.counts.items()):
+            examples = '; '.join(msg % args for msg, args in self.samples[(table, reason)])
+            self.logger.log(level, "'%s' %s: %d событий, примеры: %s", table, reason, count, examples)
+        self.counts.clear()
+        self.samples.clear()
@@ -1,81 +1,117 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import argparse
 import sqlite3
 import psycopg2
-from psycopg2.extras import execute_batch, execute_values
+from psycopg2.extras import Json, execute_values
 import logging
+import multiprocessing
+import os
 import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+from bulk_logging import SAMPLE_LIMIT, setup_logging
+from migration_rejects import PRODUCER_STAGING, REJECTS_DDL
+from stage_metrics import StageMetrics
+from staging_load import SQLITE_FETCH_SIZE, STAGING_SOURCES, copy_to_table, iter_sqlite_chunks, load_staging_rows
 
 # Конфигурация подключения
-SQLITE_DB = '/home/ivandor/Загрузки/uroboros.db.250211'
+# Переменные окружения MIGRATION_* переопределяют значения по умолчанию (см. benchmarks/)
+SQLITE_DB = os.environ.get('MIGRATION_SQLITE_DB', '/home/ivandor/Загрузки/uroboros.db.250211')
 POSTGRES_CONFIG = {
-    'dbname': 'uroboros',
-    'user': 'owner',
-    'password': '1111',
-    'host': 'localhost',
-    'port': '5432'
+    'dbname': os.environ.get('MIGRATION_PG_DBNAME', 'uroboros'),
+    'user': os.environ.get('MIGRATION_PG_USER', 'owner'),
+    'password': os.environ.get('MIGRATION_PG_PASSWORD', '1111'),
+    'host': os.environ.get('MIGRATION_PG_HOST', 'localhost'),
+    'port': os.environ.get('MIGRATION_PG_PORT', '5432')
 }
 
+# Режим загрузки staging: 'copy' — потоковый COPY FROM STDIN, 'insert' — execute_batch
+# (источники staging и загрузка — staging_load.py)
+STAGING_LOAD_MODE = 'copy'
+# Число процессов параллельной загрузки staging (1 — последовательная загрузка в одном соединении).
+# Процессы запускаются методом spawn и настраивают логирование сами (init_staging_worker)
+STAGING_WORKERS = 1
+# Таблицы с большим диапазоном rowid делятся на части такого размера, каждая — отдельному воркеру
+STAGING_RANGE_ROWS = 500000
+# Извлекать из SQLite только строки с rowid выше сохранённого водяного знака (migration_watermarks)
+INCREMENTAL_EXTRACT = True
+
+# Профиль массовой загрузки: таблицы staging создаются UNLOGGED, ключи и индексы строятся
+# после загрузки, затем выполняется ANALYZE
+STAGING_BULK_PROFILE = True
+# Первичные ключи и индексы staging
+STAGING_INDEXES = {
+    'publishers': ["ALTER TABLE staging.publishers ADD PRIMARY KEY (old_id)"],
+    'projects': [
+        "ALTER TABLE staging.projects ADD PRIMARY KEY (old_id)",
+        "CREATE INDEX idx_staging_projects ON staging.projects (old_id)",
+    ],
+    'assemblies': [
+        "ALTER TABLE staging.assemblies ADD PRIMARY KEY (old_id)",
+        "CREATE INDEX idx_staging_assemblies_prj_ref ON staging.assemblies (prj_ref)",
+    ],
+    'src_packages': ["ALTER TABLE staging.src_packages ADD PRIMARY KEY (old_id)"],
+    'pkg_versions': [
+        "ALTER TABLE staging.pkg_versions ADD PRIMARY KEY (old_id)",
+        "CREATE INDEX idx_staging_pkg_versions_src ON staging.pkg_versions (src_pkg_ref)",
+    ],
+    'asm_pkg_vsn_lnk': ["CREATE INDEX idx_staging_asm_lnk ON staging.asm_pkg_vsn_lnk (asm_ref, pkg_vsn_ref)"],
+    'changes': ["ALTER TABLE staging.changes ADD PRIMARY KEY (old_id)"],
+    'urgency': ["ALTER TABLE staging.urgency ADD PRIMARY KEY (old_id)"],
+    'vulnerabilities': ["ALTER TABLE staging.vulnerabilities ADD PRIMARY KEY (old_id)"],
+    'chg_vln_lnk': ["CREATE INDEX idx_staging_chg_vln ON staging.chg_vln_lnk (chg_ref, vln_ref)"],
+}
+
+# Возвращать строки из migration_rejects в staging при следующем запуске
+RETRY_REJECTS = True
+
+# JSON-сводка по этапам (время, строки, трафик, пиковый RSS)
+METRICS_PATH = 'migration_incremental_metrics.json'
+
 # Настройка логирования
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(levelname)s - [%(module)s:%(lineno)d] - %(message)s',
-    handlers=[
-        logging.FileHandler("migration_incremental.log"),
-        logging.StreamHandler(sys.stdout)
-    ]
-)
+# Настройка логирования: setup_logging вызывается в main() (фоновая очередь, bulk_logging.py)
+# и в init_staging_worker (процессы пула пишут напрямую)
+LOG_FILE = "migration_incremental.log"
+LOG_FORMAT = '%(asctime)s - %(levelname)s - [%(module)s:%(lineno)d] - %(message)s'
 logger = logging.getLogger(__name__)
+metrics = StageMetrics('final_script')
 
 
 class IdMapper:
     """
-    Класс для хранения соотношения старых и новых идентификаторов.
-    Структура: { 'projects': {old_id: new_id, ...}, 'assemblies': {...}, ... }
+    Маппинги старых и новых идентификаторов, добавленные шагом обработки и ещё не записанные
+    в id_mappings: { 'projects': {old_id: new_id}, ... }. Дельта записывается после каждого шага
+    (update_id_mappings), а шаги разрешают id по таблице id_mappings на сервере, поэтому
+    маппинги всего запуска в памяти не хранятся.
     """
     def __init__(self):
-        self.mappings = {
-            'projects': {},
-            'assemblies': {},
-            'src_packages': {},
-            'pkg_versions': {},
-            'changes': {},
-            'urgency': {},
-            'vulnerabilities': {}
-        }
+        self.pending = {}
         logger.debug("Инициализация IdMapper")
 
     def add_mapping(self, table, old_id, new_id):
-        self.mappings.setdefault(table, {})[old_id] = new_id
-        # logger.debug(f"Добавлен маппинг: {table}[{old_id}] -> {new_id}")
+        self.pending.setdefault(table, {})[old_id] = new_id
 
-    def get_new_id(self, table, old_id):
-        return self.mappings.get(table, {}).get(old_id)
+    def pending_count(self):
+        return sum(len(v) for v in self.pending.values())
 
+    def iter_pending(self):
+        """Строки (table_name, old_id, new_id), ещё не записанные в id_mappings."""
+        for table_name, mapping in self.pending.items():
+            for old_id, new_id in mapping.items():
+                yield table_name, old_id, new_id
 
-def load_existing_mappings(pg_conn, id_mapper):
-    """
-    Загружает уже существующие маппинги из таблицы id_mappings в объект IdMapper.
-    """
-    logger.info("Загрузка существующих маппингов из id_mappings")
-    try:
-        with pg_conn.cursor() as cur:
-            cur.execute("SELECT table_name, old_id, new_id FROM id_mappings")
-            rows = cur.fetchall()
-            for table_name, old_id, new_id in rows:
-                id_mapper.add_mapping(table_name, old_id, new_id)
-        logger.info(f"Загружено маппингов: {sum(len(v) for v in id_mapper.mappings.values())}")
-    except Exception as e:
-        logger.error(f"Ошибка загрузки маппингов: {e}")
-        raise
+    def clear_pending(self):
+        self.pending = {}
 
 
-def update_id_mappings(pg_conn, id_mapper):
+def setup_id_mappings(pg_conn):
     """
-    Обновляет (дополняет) таблицу id_mappings новыми соотношениями.
+    Однократная подготовка таблицы id_mappings (и её первичного ключа)
+    и временной таблицы для дельты маппингов текущей сессии.
     """
-    logger.info("Обновление таблицы id_mappings")
+    logger.info("Подготовка таблицы id_mappings")
     try:
         with pg_conn.cursor() as cur:
             cur.execute("""
@@ -85,7 +121,6 @@ def update_id_mappings(pg_conn, id_mapper):
                     new_id INTEGER
                 )
             """)
-            pg_conn.commit()
             cur.execute("""
                 DO $$
                 BEGIN
@@ -98,23 +133,43 @@ def update_id_mappings(pg_conn, id_mapper):
                     END IF;
                 END $$;
             """)
+            cur.execute("""
+                CREATE TEMP TABLE IF NOT EXISTS id_mappings_delta (
+                    table_name TEXT,
+                    old_id INTEGER,
+                    new_id INTEGER
+                ) ON COMMIT DELETE ROWS
+            """)
+        pg_conn.commit()
+    except Exception as e:
+        pg_conn.rollback()
+        logger.error(f"Ошибка подготовки id_mappings: {e}")
+        raise
+
+
+def update_id_mappings(pg_conn, id_mapper):
+    """
+    Дописывает в id_mappings только маппинги, появившиеся после предыдущего вызова:
+    дельта передаётся через COPY во временную таблицу и сливается одним INSERT.
+    Требует предварительного вызова setup_id_mappings.
+    """
+    pending = id_mapper.pending_count()
+    if not pending:
+        logger.info("Новых маппингов для id_mappings нет")
+        return
+    logger.info(f"Обновление таблицы id_mappings: новых маппингов {pending}")
+    try:
+        with metrics.stage('update_id_mappings') as stage, pg_conn.cursor() as cur:
+            stage['rows'] = pending
+            copy_to_table(cur, 'id_mappings_delta', ('table_name', 'old_id', 'new_id'),
+                          id_mapper.iter_pending())
+            cur.execute("""
+                INSERT INTO id_mappings (table_name, old_id, new_id)
+                SELECT table_name, old_id, new_id FROM id_mappings_delta
+                ON CONFLICT (table_name, old_id) DO NOTHING
+            """)
             pg_conn.commit()
-            for table_name, mapping in id_mapper.mappings.items():
-                if not mapping:
-                    continue
-                data = [(table_name, old_id, new_id) for old_id, new_id in mapping.items()]
-                execute_values(
-                    cur,
-                    """
-                    INSERT INTO id_mappings (table_name, old_id, new_id)
-                    VALUES %s
-                    ON CONFLICT (table_name, old_id) DO NOTHING
-                    """,
-                    data,
-                    template="(%s, %s, %s)",
-                    page_size=1000
-                )
-            pg_conn.commit()
+            id_mapper.clear_pending()
             logger.info("Таблица id_mappings успешно обновлена")
     except Exception as e:
         pg_conn.rollback()
@@ -122,9 +177,259 @@ def update_id_mappings(pg_conn, id_mapper):
         raise
 
 
+def setup_watermarks(pg_conn):
+    """
+    Создаёт таблицу водяных знаков извлечения: максимальный rowid каждой таблицы SQLite,
+    перенесённый последним успешным запуском.
+    """
+    try:
+        with pg_conn.cursor() as cur:
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS migration_watermarks (
+                    table_name TEXT PRIMARY KEY,
+                    max_rowid BIGINT NOT NULL,
+                    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+                )
+            """)
+        pg_conn.commit()
+    except Exception as e:
+        pg_conn.rollback()
+        logger.error(f"Ошибка создания migration_watermarks: {e}")
+        raise
+
+
+def load_watermarks(pg_conn):
+    """
+    Возвращает водяные знаки {таблица: max_rowid}.
+    """
+    with pg_conn.cursor() as cur:
+        cur.execute("SELECT table_name, max_rowid FROM migration_watermarks")
+        watermarks = dict(cur.fetchall())
+    logger.info(f"Водяные знаки извлечения: {watermarks}")
+    return watermarks
+
+
+def save_watermarks(pg_conn, bounds):
+    """
+    Сохраняет верхние границы перенесённых диапазонов rowid как новые водяные знаки.
+    Вызывается только после успешной обработки staging.
+    """
+    rows = [(table, rowid_range[1]) for table, rowid_range in bounds.items() if rowid_range is not None]
+    if not rows:
+        return
+    try:
+        with pg_conn.cursor() as cur:
+            execute_values(
+                cur,
+                """
+                INSERT INTO migration_watermarks (table_name, max_rowid)
+                VALUES %s
+                ON CONFLICT (table_name) DO UPDATE
+                SET max_rowid = EXCLUDED.max_rowid, updated_at = NOW()
+                """,
+                rows
+            )
+        pg_conn.commit()
+        logger.info(f"Водяные знаки обновлены: {dict(rows)}")
+    except Exception as e:
+        pg_conn.rollback()
+        logger.error(f"Ошибка сохранения водяных знаков: {e}")
+        raise
+
+
+def setup_ledger(pg_conn):
+    """
+    Создаёт журнал запуска migration_ledger: диапазоны извлечения, завершённые задачи
+    staging и зафиксированные шаги обработки. По нему --resume продолжает прерванный запуск.
+    """
+    try:
+        with pg_conn.cursor() as cur:
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS migration_ledger (
+                    step TEXT PRIMARY KEY,
+                    details JSONB,
+                    completed_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+                )
+            """)
+        pg_conn.commit()
+    except Exception as e:
+        pg_conn.rollback()
+        logger.error(f"Ошибка создания migration_ledger: {e}")
+        raise
+
+
+def start_run(pg_conn, bounds):
+    """
+    Начинает новый запуск: очищает журнал и сохраняет диапазоны извлечения,
+    чтобы продолжение работало с теми же диапазонами rowid.
+    """
+    with pg_conn.cursor() as cur:
+        cur.execute("DELETE FROM migration_ledger")
+        record_step(cur, 'bounds', bounds)
+    pg_conn.commit()
+
+
+def load_ledger(pg_conn):
+    """
+    Возвращает журнал прерванного запуска {шаг: details} или пустой словарь,
+    если продолжать нечего (staging удалён или UNLOGGED-таблицы сброшены сбоем сервера).
+    """
+    with pg_conn.cursor() as cur:
+        cur.execute("SELECT to_regclass('staging.run_marker') IS NOT NULL")
+        if not cur.fetchone()[0]:
+            return {}
+        cur.execute("SELECT EXISTS (SELECT 1 FROM staging.run_marker)")
+        if not cur.fetchone()[0]:
+            return {}
+        cur.execute("SELECT step, details FROM migration_ledger")
+        ledger = dict(cur.fetchall())
+    return ledger if 'bounds' in ledger else {}
+
+
+def record_step(cur, step, details=None):
+    """
+    Отмечает шаг выполненным в текущей транзакции, чтобы запись фиксировалась
+    вместе с данными шага.
+    """
+    cur.execute(
+        """
+        INSERT INTO migration_ledger (step, details) VALUES (%s, %s)
+        ON CONFLICT (step) DO NOTHING
+        """,
+        (step, Json(details) if details is not None else None)
+    )
+
+
+def staging_task_key(table, rowid_range):
+    """
+    Имя задачи загрузки staging в migration_ledger.
+    """
+    return f"staging:{table}:{rowid_range[0]}-{rowid_range[1]}"
+
+
+def setup_rejects(pg_conn):
+    """
+    Создаёт таблицу карантина migration_rejects: строки staging, которые не удалось
+    перенести (нет маппинга, пустое имя), вместе с причиной и исходными данными.
+    DDL общий с main.py (migration_rejects.py).
+    """
+    try:
+        with pg_conn.cursor() as cur:
+            for statement in REJECTS_DDL:
+                cur.execute(statement)
+        pg_conn.commit()
+    except Exception as e:
+        pg_conn.rollback()
+        logger.error(f"Ошибка создания migration_rejects: {e}")
+        raise
+
+
+def reject_staging_rows(cur, source_table, reason, select_sql):
+    """
+    Переносит отклонённые строки в migration_rejects одним INSERT ... SELECT.
+    select_sql возвращает строки staging.<source_table> под псевдонимом s.
+    В лог попадает одна строка на причину: количество и первые SAMPLE_LIMIT old_id.
+    Возвращает количество отклонённых строк.
+    """
+    old_id = 's.old_id' if 'old_id' in STAGING_SOURCES[source_table]['columns'] else 'NULL'
+    cur.execute(f"""
+        INSERT INTO migration_rejects (source_table, old_id, reason, payload, producer)
+        SELECT %s, {old_id}, %s, to_jsonb(s), %s
+        {select_sql}
+        RETURNING old_id
+    """, (source_table, reason, PRODUCER_STAGING))
+    rejected = cur.rowcount
+    if rejected:
+        samples = [row[0] for row in cur.fetchmany(SAMPLE_LIMIT)]
+        logger.warning("Отклонено строк %s (%s): %d, примеры old_id: %s", source_table, reason, rejected, samples)
+    return rejected
+
+
+def restage_rejects(pg_conn):
+    """
+    Возвращает строки из migration_rejects в staging (jsonb_populate_record по payload)
+    и отмечает их retrying. Из карантина строки удаляет purge_retried_rejects только после
+    успешного запуска: если запуск прервётся, а staging будет пересоздан, строки вернутся
+    в staging снова. Если причина не устранена, строка будет отклонена снова новой записью.
+    Возвращаются только записи final_script.py (producer), payload которых содержит все
+    столбцы staging и непустой old_id; остальные остаются в карантине без изменений.
+    Строки, уже извлечённые в staging текущим запуском, не дублируются.
+    """
+    try:
+        with metrics.stage('restage_rejects') as stage, pg_conn.cursor() as cur:
+            for table, source in STAGING_SOURCES.items():
+                columns = ', '.join(f'r.{column}' for column in source['columns'])
+                restageable = "producer = %(producer)s AND payload ?& %(columns)s"
+                if 'old_id' in source['columns']:
+                    restageable += " AND payload->>'old_id' IS NOT NULL"
+                    # Строка могла попасть в staging и текущим извлечением; после прерванного
+                    # запуска у old_id может быть несколько записей — берётся последняя
+                    select_rows = f"""
+                        SELECT DISTINCT ON (r.old_id) {columns}
+                        FROM retried, jsonb_populate_record(NULL::staging.{table}, retried.payload) r
+                        WHERE NOT EXISTS (SELECT 1 FROM staging.{table} s WHERE s.old_id = r.old_id)
+                        ORDER BY r.old_id, retried.id DESC
+                    """
+                else:
+                    matches = ' AND '.join(f's.{column} = r.{column}' for column in source['columns'])
+                    select_rows = f"""
+                        SELECT DISTINCT {columns}
+                        FROM retried, jsonb_populate_record(NULL::staging.{table}, retried.payload) r
+                        WHERE NOT EXISTS (SELECT 1 FROM staging.{table} s WHERE {matches})
+                    """
+                params = {'table': table, 'producer': PRODUCER_STAGING, 'columns': list(source['columns'])}
+                cur.execute(f"""
+                    WITH retried AS (
+                        UPDATE migration_rejects SET retrying = TRUE
+                        WHERE source_table = %(table)s AND {restageable}
+                        RETURNING id, payload
+                    )
+                    INSERT INTO staging.{table} ({', '.join(source['columns'])})
+                    {select_rows}
+                """, params)
+                if cur.rowcount:
+                    stage['rows'] += cur.rowcount
+                    logger.info(f"Возвращено в staging из карантина {table}: {cur.rowcount}")
+                cur.execute(f"""
+                    SELECT COUNT(*) FROM migration_rejects
+                    WHERE source_table = %(table)s AND producer = %(producer)s AND NOT ({restageable})
+                """, params)
+                skipped = cur.fetchone()[0]
+                if skipped:
+                    logger.warning(f"Записи карантина {table} без столбцов staging или old_id, "
+                                   f"оставлены в карантине: {skipped}")
+            record_step(cur, 'staging:rejects')
+        pg_conn.commit()
+    except Exception as e:
+        pg_conn.rollback()
+        logger.error(f"Ошибка возврата строк из migration_rejects: {e}")
+        raise
+
+
+def purge_retried_rejects(pg_conn):
+    """
+    Удаляет из migration_rejects строки, возвращённые в staging этим запуском (retrying).
+    Вызывается после успешной обработки staging: к этому моменту каждая такая строка
+    либо получила маппинг, либо отклонена снова новой записью.
+    """
+    try:
+        with pg_conn.cursor() as cur:
+            cur.execute("DELETE FROM migration_rejects WHERE retrying")
+            purged = cur.rowcount
+        pg_conn.commit()
+        if purged:
+            logger.info(f"Удалено из карантина повторно обработанных строк: {purged}")
+    except Exception as e:
+        pg_conn.rollback()
+        logger.error(f"Ошибка очистки migration_rejects: {e}")
+        raise
+
+
 def setup_postgres_schemas(conn):
     """
     Создаёт временную схему staging и необходимые таблицы в ней.
+    В профиле STAGING_BULK_PROFILE таблицы создаются UNLOGGED и без ключей и индексов:
+    они строятся после загрузки в build_staging_indexes.
     """
     logger.info("Настройка временной схемы PostgreSQL (staging)")
     try:
@@ -132,71 +437,76 @@ def setup_postgres_schemas(conn):
             cur.execute("DROP SCHEMA IF EXISTS staging CASCADE")
             cur.execute("CREATE SCHEMA staging")
             staging_tables = [
-                """CREATE TABLE staging.projects (
-                    old_id INTEGER PRIMARY KEY,
+                """CREATE {unlogged}TABLE staging.projects (
+                    old_id INTEGER,
                     name TEXT,
                     rls_ref INTEGER,
                     description TEXT,
                     vendor TEXT,
                     arc_ref INTEGER
                 )""",
-                """CREATE TABLE staging.assemblies (
-                    old_id INTEGER PRIMARY KEY,
+                """CREATE {unlogged}TABLE staging.assemblies (
+                    old_id INTEGER,
                     time INTEGER,
                     description TEXT,
                     prj_ref INTEGER,
                     pbr_ref INTEGER
                 )""",
-                """CREATE TABLE staging.src_packages (
-                    old_id INTEGER PRIMARY KEY,
+                """CREATE {unlogged}TABLE staging.src_packages (
+                    old_id INTEGER,
                     name TEXT
                 )""",
-                """CREATE TABLE staging.pkg_versions (
-                    old_id INTEGER PRIMARY KEY,
+                """CREATE {unlogged}TABLE staging.pkg_versions (
+                    old_id INTEGER,
                     time INTEGER,
                     maintainer TEXT,
                     src_pkg_ref INTEGER,
                     version TEXT
                 )""",
-                """CREATE TABLE staging.asm_pkg_vsn_lnk (
+                """CREATE {unlogged}TABLE staging.asm_pkg_vsn_lnk (
                     asm_ref INTEGER,
                     pkg_vsn_ref INTEGER
                 )""",
-                """CREATE TABLE staging.changes (
-                    old_id INTEGER PRIMARY KEY,
+                """CREATE {unlogged}TABLE staging.changes (
+                    old_id INTEGER,
                     pkg_vsn_ref INTEGER,
                     special TEXT
                 )""",
-                """CREATE TABLE staging.urgency (
-                    old_id INTEGER PRIMARY KEY,
+                """CREATE {unlogged}TABLE staging.urgency (
+                    old_id INTEGER,
                     name TEXT
                 )""",
-                """CREATE TABLE staging.vulnerabilities (
-                    old_id INTEGER PRIMARY KEY,
+                """CREATE {unlogged}TABLE staging.vulnerabilities (
+                    old_id INTEGER,
                     name TEXT
                 )""",
-                """CREATE TABLE staging.chg_vln_lnk (
+                """CREATE {unlogged}TABLE staging.chg_vln_lnk (
                     chg_ref INTEGER,
                     vln_ref INTEGER
                 )""",
-                """CREATE TABLE staging.publishers (
-                    old_id INTEGER PRIMARY KEY,
+                """CREATE {unlogged}TABLE staging.publishers (
+                    old_id INTEGER,
                     name TEXT
+                )""",
+                """CREATE {unlogged}TABLE staging.load_status (
+                    completed_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+                )""",
+                """CREATE {unlogged}TABLE staging.run_marker (
+                    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
                 )"""
             ]
+            unlogged = 'UNLOGGED ' if STAGING_BULK_PROFILE else ''
             for table_sql in staging_tables:
+                table_sql = table_sql.format(unlogged=unlogged)
                 logger.debug(f"Создание временной таблицы: {table_sql.split('(')[0]} ...")
                 cur.execute(table_sql)
-            indexes = [
-                "CREATE INDEX idx_staging_projects ON staging.projects (old_id)",
-                "CREATE INDEX idx_staging_assemblies_prj_ref ON staging.assemblies (prj_ref)",
-                "CREATE INDEX idx_staging_pkg_versions_src ON staging.pkg_versions (src_pkg_ref)",
-                "CREATE INDEX idx_staging_asm_lnk ON staging.asm_pkg_vsn_lnk (asm_ref, pkg_vsn_ref)",
-                "CREATE INDEX idx_staging_chg_vln ON staging.chg_vln_lnk (chg_ref, vln_ref)"
-            ]
-            for index_sql in indexes:
-                logger.debug(f"Создание индекса: {index_sql}")
-                cur.execute(index_sql)
+            if not STAGING_BULK_PROFILE:
+                for statements in STAGING_INDEXES.values():
+                    for index_sql in statements:
+                        logger.debug(f"Создание индекса: {index_sql}")
+                        cur.execute(index_sql)
+            # Маркер пропадает вместе с данными UNLOGGED-таблиц после сбоя сервера
+            cur.execute("INSERT INTO staging.run_marker DEFAULT VALUES")
             conn.commit()
             logger.info("Временная схема staging создана успешно")
     except Exception as e:
@@ -205,136 +515,187 @@ def setup_postgres_schemas(conn):
         raise
 
 
-def migrate_to_staging(sqlite_conn, pg_conn):
+def build_table_indexes(table):
+    """
+    Строит первичный ключ и индексы одной таблицы staging и собирает по ней статистику.
+    Выполняется в собственном соединении, чтобы таблицы обрабатывались параллельно.
+    """
+    pg_conn = psycopg2.connect(**POSTGRES_CONFIG, cursor_factory=metrics.cursor_factory())
+    try:
+        with pg_conn.cursor() as cur:
+            for index_sql in STAGING_INDEXES.get(table, []):
+                logger.debug(f"Создание индекса: {index_sql}")
+                cur.execute(index_sql)
+            cur.execute(f"ANALYZE staging.{table}")
+            record_step(cur, f"staging:indexes:{table}")
+        pg_conn.commit()
+    except Exception:
+        pg_conn.rollback()
+        raise
+    finally:
+        pg_conn.close()
+
+
+def build_staging_indexes(workers=STAGING_WORKERS, completed=()):
+    """
+    Отложенное построение ключей и индексов staging после загрузки (профиль
+    STAGING_BULK_PROFILE) и ANALYZE, чтобы anti-join'ы process_staging_data
+    получили корректные планы. Таблицы обрабатываются параллельно;
+    таблицы из completed (прерванный запуск) пропускаются.
+    """
+    logger.info("Построение индексов и сбор статистики staging")
+    tables = [table for table in STAGING_SOURCES if f"staging:indexes:{table}" not in completed]
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+        futures = [pool.submit(build_table_indexes, table) for table in tables]
+        for future in futures:
+            future.result()
+    logger.info("Индексы staging построены")
+
+
+def load_staging_table(sql_cur, pg_cur, table, chunk_size=SQLITE_FETCH_SIZE, rowid_range=None):
+    """
+    Переносит одну таблицу (или диапазон rowid таблицы) из SQLite в staging.
+    Возвращает количество перенесённых строк.
+    """
+    source = STAGING_SOURCES[table]
+    query = source['query']
+    params = ()
+    if rowid_range is not None:
+        query = f"{query} WHERE {source['rowid']} BETWEEN ? AND ?"
+        params = rowid_range
+    sql_cur.execute(query, params)
+    return load_staging_rows(pg_cur, table, iter_sqlite_chunks(sql_cur, chunk_size), STAGING_LOAD_MODE)
+
+
+def get_extraction_bounds(sqlite_conn, watermarks=None):
+    """
+    Диапазоны rowid для извлечения из SQLite: {таблица: (от, до)}.
+    Нижняя граница — следующий rowid после водяного знака (или минимальный rowid),
+    верхняя — максимальный rowid на момент запуска. None — извлекать нечего.
+    """
+    watermarks = watermarks or {}
+    bounds = {}
+    sql_cur = sqlite_conn.cursor()
+    for table in STAGING_SOURCES:
+        sql_cur.execute(f"SELECT MIN(rowid), MAX(rowid) FROM {table}")
+        min_rowid, max_rowid = sql_cur.fetchone()
+        if table in watermarks and min_rowid is not None:
+            min_rowid = max(min_rowid, watermarks[table] + 1)
+        if max_rowid is None or min_rowid > max_rowid:
+            bounds[table] = None
+        else:
+            bounds[table] = (min_rowid, max_rowid)
+    return bounds
+
+
+def plan_staging_tasks(bounds):
+    """
+    Разбивает перенос staging на независимые задачи (таблица, диапазон rowid).
+    Диапазоны длиннее STAGING_RANGE_ROWS делятся на части.
+    Задачи отсортированы по убыванию размера, чтобы крупные стартовали первыми.
+    """
+    tasks = []
+    for table, rowid_range in bounds.items():
+        if rowid_range is None:
+            continue
+        min_rowid, max_rowid = rowid_range
+        for low in range(min_rowid, max_rowid + 1, STAGING_RANGE_ROWS):
+            high = min(low + STAGING_RANGE_ROWS - 1, max_rowid)
+            tasks.append((high - low + 1, table, (low, high)))
+    tasks.sort(key=lambda task: task[0], reverse=True)
+    return [(table, rowid_range) for _, table, rowid_range in tasks]
+
+
+def init_staging_worker():
+    """
+    Инициализатор процесса пула staging: логирование без фонового потока,
+    так как процесс пула завершается без вызова обработчиков atexit.
+    """
+    setup_logging(LOG_FILE, sys.stdout, LOG_FORMAT, background=False)
+
+
+def stage_table_worker(table, rowid_range, chunk_size):
+    """
+    Задача воркера параллельной загрузки: переносит таблицу или её диапазон rowid
+    в собственных соединениях с SQLite и PostgreSQL и фиксирует результат.
+    Трафик воркера возвращается родителю вместе с количеством строк.
+    """
+    worker_metrics = StageMetrics('stage_table_worker')
+    sqlite_conn = sqlite3.connect(SQLITE_DB)
+    pg_conn = psycopg2.connect(**POSTGRES_CONFIG, cursor_factory=worker_metrics.cursor_factory())
+    try:
+        with pg_conn.cursor() as pg_cur:
+            count = load_staging_table(sqlite_conn.cursor(), pg_cur, table, chunk_size, rowid_range)
+            record_step(pg_cur, staging_task_key(table, rowid_range))
+        pg_conn.commit()
+        return table, count, worker_metrics.bytes_sent, worker_metrics.round_trips
+    except Exception:
+        pg_conn.rollback()
+        raise
+    finally:
+        pg_conn.close()
+        sqlite_conn.close()
+
+
+def mark_staging_complete(pg_conn):
+    """
+    Записывает маркер завершения staging. Без него process_staging_data не запускается.
+    """
+    with pg_conn.cursor() as cur:
+        cur.execute("INSERT INTO staging.load_status DEFAULT VALUES")
+        record_step(cur, 'staging')
+    pg_conn.commit()
+
+
+def check_staging_complete(pg_conn):
+    """
+    Проверяет наличие маркера завершения staging.
+    """
+    with pg_conn.cursor() as cur:
+        cur.execute("SELECT EXISTS (SELECT 1 FROM staging.load_status)")
+        if not cur.fetchone()[0]:
+            raise RuntimeError("Загрузка staging не завершена: маркер staging.load_status отсутствует")
+
+
+def migrate_to_staging(sqlite_conn, pg_conn, bounds=None, chunk_size=SQLITE_FETCH_SIZE,
+                       workers=STAGING_WORKERS, completed=()):
     """
     Перенос данных из SQLite в схему staging в PostgreSQL.
+    bounds ограничивает извлечение диапазонами rowid (см. get_extraction_bounds),
+    по умолчанию переносятся таблицы целиком.
+    При workers > 1 таблицы и диапазоны rowid крупных таблиц загружаются параллельно,
+    каждый воркер — в своём соединении. Каждая задача фиксируется вместе с записью
+    в migration_ledger, задачи из completed (прерванный запуск) не повторяются.
+    Загрузка считается выполненной только после записи маркера в staging.load_status.
     """
     logger.info("Начало миграции данных в staging")
     id_mapper = IdMapper()
+    if 'staging' in completed:
+        logger.info("Staging загружен прерванным запуском, перенос пропущен")
+        return id_mapper
+    if bounds is None:
+        bounds = get_extraction_bounds(sqlite_conn)
+    tasks = plan_staging_tasks(bounds)
+    pending_tasks = [(table, rowid_range) for table, rowid_range in tasks
+                     if staging_task_key(table, rowid_range) not in completed]
+    if len(pending_tasks) < len(tasks):
+        logger.info(f"Пропущено завершённых задач staging: {len(tasks) - len(pending_tasks)}")
     try:
-        sql_cur = sqlite_conn.cursor()
-        pg_cur = pg_conn.cursor()
-        # publishers
-        logger.info("Перенос publishers...")
-        sql_cur.execute("SELECT id, name FROM publishers")
-        publishers = sql_cur.fetchall()
-        if publishers:
-            execute_batch(pg_cur,
-                          "INSERT INTO staging.publishers (old_id, name) VALUES (%s, %s)",
-                          publishers)
-            logger.info(f"Перенесено publishers: {len(publishers)}")
-        else:
-            logger.warning("Таблица publishers пуста")
-        # projects (с объединением с publishers)
-        logger.info("Перенос projects...")
-        sql_cur.execute("""
-            SELECT p.id, p.name, p.rls_ref, p.description, pub.name, p.arc_ref 
-            FROM projects p
-            JOIN publishers pub ON p.pbr_ref = pub.id
-        """)
-        projects = sql_cur.fetchall()
-        if projects:
-            execute_batch(pg_cur,
-                          """INSERT INTO staging.projects 
-                             (old_id, name, rls_ref, description, vendor, arc_ref)
-                             VALUES (%s, %s, %s, %s, %s, %s)""",
-                          projects)
-            logger.info(f"Перенесено projects: {len(projects)}")
-        else:
-            logger.warning("Таблица projects пуста")
-        # assemblies
-        logger.info("Перенос assemblies...")
-        sql_cur.execute("SELECT id, time, description, prj_ref, pbr_ref FROM assemblies")
-        assemblies = sql_cur.fetchall()
-        if assemblies:
-            execute_batch(pg_cur,
-                          """INSERT INTO staging.assemblies 
-                             (old_id, time, description, prj_ref, pbr_ref)
-                             VALUES (%s, %s, %s, %s, %s)""",
-                          assemblies)
-            logger.info(f"Перенесено assemblies: {len(assemblies)}")
-        else:
-            logger.warning("Таблица assemblies пуста")
-        # src_packages
-        logger.info("Перенос src_packages...")
-        sql_cur.execute("SELECT id, name FROM src_packages")
-        packages = sql_cur.fetchall()
-        if packages:
-            execute_batch(pg_cur,
-                          "INSERT INTO staging.src_packages (old_id, name) VALUES (%s, %s)",
-                          packages)
-            logger.info(f"Перенесено src_packages: {len(packages)}")
-        else:
-            logger.warning("Таблица src_packages пуста")
-        # pkg_versions
-        logger.info("Перенос pkg_versions...")
-        sql_cur.execute("SELECT id, time, maintainer, src_pkg_ref, version FROM pkg_versions")
-        versions = sql_cur.fetchall()
-        if versions:
-            execute_batch(pg_cur,
-                          """INSERT INTO staging.pkg_versions 
-                             (old_id, time, maintainer, src_pkg_ref, version)
-                             VALUES (%s, %s, %s, %s, %s)""",
-                          versions)
-            logger.info(f"Перенесено pkg_versions: {len(versions)}")
-        else:
-            logger.warning("Таблица pkg_versions пуста")
-        # asm_pkg_vsn_lnk
-        logger.info("Перенос asm_pkg_vsn_lnk...")
-        sql_cur.execute("SELECT asm_ref, pkg_vsn_ref FROM asm_pkg_vsn_lnk")
-        links = sql_cur.fetchall()
-        if links:
-            execute_batch(pg_cur,
-                          "INSERT INTO staging.asm_pkg_vsn_lnk (asm_ref, pkg_vsn_ref) VALUES (%s, %s)",
-                          links)
-            logger.info(f"Перенесено связей asm_pkg_vsn_lnk: {len(links)}")
-        else:
-            logger.warning("Таблица asm_pkg_vsn_lnk пуста")
-        # changes
-        logger.info("Перенос changes...")
-        sql_cur.execute("SELECT id, pkg_vsn_ref, special FROM changes")
-        changes = sql_cur.fetchall()
-        if changes:
-            execute_batch(pg_cur,
-                          "INSERT INTO staging.changes (old_id, pkg_vsn_ref, special) VALUES (%s, %s, %s)",
-                          changes)
-            logger.info(f"Перенесено changes: {len(changes)}")
-        else:
-            logger.warning("Таблица changes пуста")
-        # urgency
-        logger.info("Перенос urgency...")
-        sql_cur.execute("SELECT id, name FROM urgency")
-        urgency = sql_cur.fetchall()
-        if urgency:
-            execute_batch(pg_cur,
-                          "INSERT INTO staging.urgency (old_id, name) VALUES (%s, %s)",
-                          urgency)
-            logger.info(f"Перенесено urgency: {len(urgency)}")
-        else:
-            logger.warning("Таблица urgency пуста")
-        # vulnerabilities
-        logger.info("Перенос vulnerabilities...")
-        sql_cur.execute("SELECT id, name FROM vulnerabilities")
-        vulns = sql_cur.fetchall()
-        if vulns:
-            execute_batch(pg_cur,
-                          "INSERT INTO staging.vulnerabilities (old_id, name) VALUES (%s, %s)",
-                          vulns)
-            logger.info(f"Перенесено vulnerabilities: {len(vulns)}")
-        else:
-            logger.warning("Таблица vulnerabilities пуста")
-        # chg_vln_lnk
-        logger.info("Перенос chg_vln_lnk...")
-        sql_cur.execute("SELECT chg_ref, vln_ref FROM chg_vln_lnk")
-        chg_vln = sql_cur.fetchall()
-        if chg_vln:
-            execute_batch(pg_cur,
-                          "INSERT INTO staging.chg_vln_lnk (chg_ref, vln_ref) VALUES (%s, %s)",
-                          chg_vln)
-            logger.info(f"Перенесено связей chg_vln_lnk: {len(chg_vln)}")
-        else:
-            logger.warning("Таблица chg_vln_lnk пуста")
-        pg_conn.commit()
+        with metrics.stage('staging_load') as stage:
+            if workers > 1:
+                counts = migrate_to_staging_parallel(pending_tasks, chunk_size, workers)
+            else:
+                counts = migrate_to_staging_sequential(sqlite_conn, pg_conn, pending_tasks, chunk_size)
+            stage['rows'] = sum(counts.values())
+        for table, rowid_range in bounds.items():
+            if rowid_range is None:
+                logger.warning(f"Нет строк для переноса из {table}")
+            elif counts.get(table):
+                logger.info(f"Перенесено {table}: {counts[table]}")
+        if STAGING_BULK_PROFILE:
+            with metrics.stage('staging_indexes'):
+                build_staging_indexes(workers, completed)
+        mark_staging_complete(pg_conn)
         logger.info("Миграция в staging завершена успешно")
         return id_mapper
     except Exception as e:
@@ -343,257 +704,406 @@ def migrate_to_staging(sqlite_conn, pg_conn):
         raise
 
 
-def process_staging_data(pg_conn, id_mapper):
+def migrate_to_staging_sequential(sqlite_conn, pg_conn, tasks, chunk_size):
     """
-    Обработка данных из staging и перенос в основные таблицы.
+    Последовательный перенос задач staging в одном соединении; каждая задача
+    фиксируется отдельной транзакцией. Возвращает {таблица: перенесено строк}.
     """
-    logger.info("Начало обработки данных из staging")
-    try:
-        with pg_conn.cursor() as cur:
-            # 1. Обработка projects
-            logger.info("Обработка проектов (projects) – вставляем только новые записи")
-            cur.execute("""
-                SELECT s.old_id
-                FROM staging.projects s
-                LEFT JOIN id_mappings m ON s.old_id = m.old_id AND m.table_name = 'projects'
-                WHERE m.old_id IS NULL
-                ORDER BY s.old_id
-            """)
-            new_old_ids = [row[0] for row in cur.fetchall()]
-            if new_old_ids:
-                cur.execute("""
-                    WITH new_data AS (
-                        SELECT s.old_id,
-                               COALESCE(s.name, 'unknown') AS prj_name,
-                               NULLIF(s.rls_ref, 0) AS rel_id,
-                               s.description AS prj_desc,
-                               COALESCE(s.vendor, 'unknown') AS vendor,
-                               NULLIF(s.arc_ref, 0) AS arch_id
-                        FROM staging.projects s
-                        WHERE s.old_id = ANY(%s)
-                        ORDER BY s.old_id
-                    )
-                    INSERT INTO repositories.project (prj_name, rel_id, prj_desc, vendor, arch_id)
-                    SELECT prj_name, rel_id, prj_desc, vendor, arch_id
-                    FROM new_data
-                    RETURNING prj_id
-                """, (new_old_ids,))
-                new_project_ids = [row[0] for row in cur.fetchall()]
-                for old_id, new_id in zip(new_old_ids, new_project_ids):
-                    id_mapper.add_mapping('projects', old_id, new_id)
-                logger.info(f"Обработано новых проектов: {len(new_project_ids)}")
-                update_id_mappings(pg_conn, id_mapper)
-            else:
-                logger.info("Новых проектов для обработки нет")
+    counts = dict.fromkeys(STAGING_SOURCES, 0)
+    sql_cur = sqlite_conn.cursor()
+    with pg_conn.cursor() as pg_cur:
+        for table, rowid_range in tasks:
+            logger.info(f"Перенос {table} (rowid {rowid_range[0]}-{rowid_range[1]})...")
+            counts[table] += load_staging_table(sql_cur, pg_cur, table, chunk_size, rowid_range)
+            record_step(pg_cur, staging_task_key(table, rowid_range))
+            pg_conn.commit()
+    return counts
 
-            # 2. Обработка assemblies
-            logger.info("Обработка сборок (assemblies) – вставляем только новые записи")
-            cur.execute("""
-                WITH assemblies_data AS (
-                    SELECT a.old_id,
-                           COALESCE(to_timestamp(NULLIF(a.time, 0)), NOW()) AS assm_date_created,
-                           COALESCE(a.description, 'No description') AS description,
-                           m_proj.new_id AS prj_id
-                    FROM staging.assemblies a
-                    INNER JOIN id_mappings m_proj ON a.prj_ref = m_proj.old_id AND m_proj.table_name = 'projects'
-                    LEFT JOIN id_mappings m_asm ON a.old_id = m_asm.old_id AND m_asm.table_name = 'assemblies'
-                    WHERE m_asm.old_id IS NULL
-                ),
-                inserted_assemblies AS (
-                    INSERT INTO repositories.assembly (assm_date_created, assm_desc, prj_id, assm_version)
-                    SELECT assm_date_created, description, prj_id, ' '
-                    FROM assemblies_data
-                    RETURNING assm_id, prj_id, assm_date_created, assm_desc
-                )
-                SELECT ia.assm_id, ad.old_id
-                FROM inserted_assemblies ia
-                JOIN assemblies_data ad
-                  ON ia.prj_id = ad.prj_id
-                 AND ia.assm_date_created = ad.assm_date_created
-                 AND ia.assm_desc = ad.description
-            """)
-            assemblies_mapping = cur.fetchall()
-            for new_id, old_id in assemblies_mapping:
-                id_mapper.add_mapping('assemblies', old_id, new_id)
-            logger.info(f"Обработано новых сборок: {len(assemblies_mapping)}")
-            update_id_mappings(pg_conn, id_mapper)
-
-            # 3. Обработка src_packages
-            logger.info("Обработка исходных пакетов (src_packages) – вставляем только новые записи")
-            cur.execute("""
-                SELECT s.old_id, s.name
-                FROM staging.src_packages s
-                LEFT JOIN id_mappings m ON s.old_id = m.old_id AND m.table_name = 'src_packages'
-                WHERE s.name IS NOT NULL AND m.old_id IS NULL
-                ORDER BY s.old_id
-            """)
-            new_src = cur.fetchall()
-            if new_src:
-                for old_id, pkg_name in new_src:
-                    cur.execute("""
-                        INSERT INTO repositories.package (pkg_name)
-                        VALUES (%s)
-                        ON CONFLICT (pkg_name) DO UPDATE SET pkg_name = EXCLUDED.pkg_name
-                        RETURNING pkg_id
-                    """, (pkg_name,))
-                    pkg_id = cur.fetchone()[0]
-                    id_mapper.add_mapping('src_packages', old_id, pkg_id)
-                logger.info(f"Обработано новых src_packages: {len(new_src)}")
-                update_id_mappings(pg_conn, id_mapper)
-            else:
-                logger.info("Новых src_packages для обработки нет")
 
-            # 4. Обработка pkg_versions – обрабатываем по одной записи, чтобы избежать блокировок
-            logger.info("Обработка версий пакетов (pkg_versions) – вставляем только новые записи")
-            cur.execute("""
-                SELECT pv.old_id, pv.time, pv.maintainer, pv.src_pkg_ref, pv.version
-                FROM staging.pkg_versions pv
-                LEFT JOIN id_mappings m_ver ON pv.old_id = m_ver.old_id AND m_ver.table_name = 'pkg_versions'
-                WHERE m_ver.old_id IS NULL
-                ORDER BY pv.old_id
-            """)
-            new_versions = cur.fetchall()
-            processed_versions = 0
-            if new_versions:
-                for old_id, time_val, maintainer, src_pkg_ref, version in new_versions:
-                    pkg_id = id_mapper.get_new_id('src_packages', src_pkg_ref)
-                    if pkg_id is None:
-                        logger.error(f"Для pkg_versions с old_id {old_id}: не найден mapping для src_pkg_ref {src_pkg_ref}")
-                        continue
-                    cur.execute("""
-                        INSERT INTO repositories.pkg_version (pkg_date_created, author_name, pkg_id, version)
-                        VALUES (
-                            COALESCE(to_timestamp(NULLIF(%s, 0)), NOW()),
-                            NULLIF(%s, ''),
-                            %s,
-                            COALESCE(NULLIF(%s, ''), '0.0.0')
-                        )
-                        ON CONFLICT (version, pkg_id) DO NOTHING
-                        RETURNING pkg_vrs_id
-                    """, (time_val, maintainer, pkg_id, version))
-                    res = cur.fetchone()
-                    if res is None:
-                        cur.execute("""
-                            SELECT pkg_vrs_id FROM repositories.pkg_version
-                            WHERE pkg_id = %s AND version = COALESCE(NULLIF(%s, ''), '0.0.0')
-                        """, (pkg_id, version))
-                        res = cur.fetchone()
-                    if res:
-                        pkg_vrs_id = res[0]
-                        id_mapper.add_mapping('pkg_versions', old_id, pkg_vrs_id)
-                        processed_versions += 1
-                logger.info(f"Обработано новых pkg_versions: {processed_versions}")
-                update_id_mappings(pg_conn, id_mapper)
-            else:
-                logger.info("Новых pkg_versions для обработки нет")
+def migrate_to_staging_parallel(tasks, chunk_size, workers):
+    """
+    Параллельный перенос задач staging пулом процессов. При ошибке любого воркера
+    оставшиеся задачи отменяются; уже зафиксированные задачи остаются в staging
+    и в migration_ledger для --resume. Возвращает {таблица: перенесено строк}.
+    """
+    logger.info(f"Параллельный перенос в staging: задач {len(tasks)}, воркеров {workers}")
+    counts = dict.fromkeys(STAGING_SOURCES, 0)
+    # spawn вместо fork: родитель уже держит поток QueueListener и его блокировки
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                             initializer=init_staging_worker) as pool:
+        futures = [pool.submit(stage_table_worker, table, rowid_range, chunk_size)
+                   for table, rowid_range in tasks]
+        try:
+            for future in as_completed(futures):
+                table, count, bytes_sent, round_trips = future.result()
+                counts[table] += count
+                metrics.add_traffic(bytes_sent, round_trips)
+        except Exception:
+            for future in futures:
+                future.cancel()
+            raise
+    return counts
 
-            # 5. Обработка urgency
-            logger.info("Обработка urgency – вставляем только новые записи")
-            cur.execute("""
-                SELECT s.old_id, s.name
-                FROM staging.urgency s
-                LEFT JOIN id_mappings m ON s.old_id = m.old_id AND m.table_name = 'urgency'
-                WHERE s.name IS NOT NULL AND m.old_id IS NULL
-                ORDER BY s.old_id
-            """)
-            new_urg = cur.fetchall()
-            if new_urg:
-                new_urg_old_ids = [row[0] for row in new_urg]
-                cur.execute("""
-                    WITH new_data AS (
-                        SELECT s.old_id, s.name AS urg_name
-                        FROM staging.urgency s
-                        WHERE s.old_id = ANY(%s)
-                        ORDER BY s.old_id
-                    )
-                    INSERT INTO repositories.urgency (urg_name)
-                    SELECT urg_name
-                    FROM new_data
-                    RETURNING urg_id
-                """, (new_urg_old_ids,))
-                new_urg_ids = [row[0] for row in cur.fetchall()]
-                for old_id, new_id in zip(new_urg_old_ids, new_urg_ids):
-                    id_mapper.add_mapping('urgency', old_id, new_id)
-                logger.info(f"Обработано новых urgency: {len(new_urg_ids)}")
-                update_id_mappings(pg_conn, id_mapper)
-            else:
-                logger.info("Новых urgency для обработки нет")
 
-            # 6. Обработка vulnerabilities
-            logger.info("Обработка vulnerabilities – вставляем только новые записи")
-            cur.execute("""
-                SELECT s.old_id, s.name
-                FROM staging.vulnerabilities s
-                LEFT JOIN id_mappings m ON s.old_id = m.old_id AND m.table_name = 'vulnerabilities'
-                WHERE s.name IS NOT NULL AND m.old_id IS NULL
-                ORDER BY s.old_id
-            """)
-            new_vuln = cur.fetchall()
-            if new_vuln:
-                new_vuln_old_ids = [row[0] for row in new_vuln]
-                cur.execute("""
-                    WITH new_data AS (
-                        SELECT s.old_id, s.name AS vuln_name
-                        FROM staging.vulnerabilities s
-                        WHERE s.old_id = ANY(%s)
-                        ORDER BY s.old_id
-                    )
-                    INSERT INTO repositories.vulnerabilities (name)
-                    SELECT vuln_name
-                    FROM new_data
-                    RETURNING id
-                """, (new_vuln_old_ids,))
-                new_vuln_ids = [row[0] for row in cur.fetchall()]
-                for old_id, new_id in zip(new_vuln_old_ids, new_vuln_ids):
-                    id_mapper.add_mapping('vulnerabilities', old_id, new_id)
-                logger.info(f"Обработано новых vulnerabilities: {len(new_vuln_ids)}")
-                update_id_mappings(pg_conn, id_mapper)
-            else:
-                logger.info("Новых vulnerabilities для обработки нет")
+def allocate_ids(cur, table, id_column, count):
+    """
+    Резервирует count идентификаторов из последовательности table.id_column одним
+    запросом nextval по generate_series. Строки затем вставляются с явными id,
+    и соответствие old_id -> new_id известно заранее.
+    """
+    if not count:
+        return []
+    cur.execute(
+        "SELECT nextval(pg_get_serial_sequence(%s, %s)) FROM generate_series(1, %s)",
+        (table, id_column, count)
+    )
+    return [row[0] for row in cur.fetchall()]
 
-            # 7. Обработка связей assembly-package
-            logger.info("Обработка связей assembly-package")
-            cur.execute("""
-                INSERT INTO repositories.assm_pkg_vrs (assm_id, pkg_vrs_id)
-                SELECT a.new_id, p.new_id
-                FROM staging.asm_pkg_vsn_lnk l
-                JOIN id_mappings a ON l.asm_ref = a.old_id AND a.table_name = 'assemblies'
-                JOIN id_mappings p ON l.pkg_vsn_ref = p.old_id AND p.table_name = 'pkg_versions'
-                WHERE NOT EXISTS (
-                    SELECT 1 FROM repositories.assm_pkg_vrs ap
-                    WHERE ap.assm_id = a.new_id AND ap.pkg_vrs_id = p.new_id
-                )
-            """)
-            logger.info(f"Добавлено связей assembly-package: {cur.rowcount}")
 
-            # 8. Обработка changelog (changes)
-            logger.info("Обработка changelog (changes) – вставляем только новые записи")
-            cur.execute("""
-                SELECT c.old_id, c.special, pv.time, p.new_id
-                FROM staging.changes c
-                INNER JOIN id_mappings p ON c.pkg_vsn_ref = p.old_id AND p.table_name = 'pkg_versions'
-                LEFT JOIN id_mappings m ON c.old_id = m.old_id AND m.table_name = 'changes'
-                JOIN staging.pkg_versions pv ON c.pkg_vsn_ref = pv.old_id
-                WHERE m.old_id IS NULL
-            """)
-            changes_to_process = cur.fetchall()
-            processed_changes = 0
-            for old_id, special, time_val, pkg_vrs_new_id in changes_to_process:
-                log_desc = special if special is not None else ''
-                cur.execute("""
-                    INSERT INTO repositories.changelog (log_desc, pkg_vrs_id, date_added, log_ident)
-                    VALUES (%s, %s, COALESCE(to_timestamp(NULLIF(%s, 0)), NOW()), '')
-                    RETURNING id
-                """, (log_desc, pkg_vrs_new_id, time_val))
-                result = cur.fetchone()
-                if result:
-                    new_chg_id = result[0]
-                    id_mapper.add_mapping('changes', old_id, new_chg_id)
-                    processed_changes += 1
-            logger.info(f"Обработано новых записей changelog: {processed_changes}")
-            update_id_mappings(pg_conn, id_mapper)
+def process_projects(cur, id_mapper):
+    """
+    Обработка projects – id резервируются заранее (allocate_ids),
+    поэтому маппинг old_id -> prj_id известен до вставки.
+    """
+    logger.info("Обработка проектов (projects) – вставляем только новые записи")
+    cur.execute("""
+        SELECT s.old_id
+        FROM staging.projects s
+        LEFT JOIN id_mappings m ON s.old_id = m.old_id AND m.table_name = 'projects'
+        WHERE m.old_id IS NULL
+        ORDER BY s.old_id
+    """)
+    new_old_ids = [row[0] for row in cur.fetchall()]
+    if new_old_ids:
+        new_project_ids = allocate_ids(cur, 'repositories.project', 'prj_id', len(new_old_ids))
+        cur.execute("""
+            INSERT INTO repositories.project (prj_id, prj_name, rel_id, prj_desc, vendor, arch_id)
+            SELECT n.new_id,
+                   COALESCE(s.name, 'unknown'),
+                   NULLIF(s.rls_ref, 0),
+                   s.description,
+                   COALESCE(s.vendor, 'unknown'),
+                   NULLIF(s.arc_ref, 0)
+            FROM unnest(%s::integer[], %s::integer[]) AS n(old_id, new_id)
+            JOIN staging.projects s ON s.old_id = n.old_id
+        """, (new_old_ids, new_project_ids))
+        for old_id, new_id in zip(new_old_ids, new_project_ids):
+            id_mapper.add_mapping('projects', old_id, new_id)
+        logger.info(f"Обработано новых проектов: {len(new_project_ids)}")
+        return len(new_project_ids)
+    logger.info("Новых проектов для обработки нет")
+    return 0
 
-            pg_conn.commit()
+
+def process_assemblies(cur, id_mapper):
+    """
+    Обработка assemblies – с заранее зарезервированными assm_id вместо
+    сопоставления по (prj_id, assm_date_created, assm_desc).
+    """
+    logger.info("Обработка сборок (assemblies) – вставляем только новые записи")
+    reject_staging_rows(cur, 'assemblies', 'missing_project', """
+        FROM staging.assemblies s
+        LEFT JOIN id_mappings m_proj ON s.prj_ref = m_proj.old_id AND m_proj.table_name = 'projects'
+        LEFT JOIN id_mappings m_asm ON s.old_id = m_asm.old_id AND m_asm.table_name = 'assemblies'
+        WHERE m_proj.old_id IS NULL AND m_asm.old_id IS NULL
+    """)
+    cur.execute("""
+        SELECT a.old_id
+        FROM staging.assemblies a
+        INNER JOIN id_mappings m_proj ON a.prj_ref = m_proj.old_id AND m_proj.table_name = 'projects'
+        LEFT JOIN id_mappings m_asm ON a.old_id = m_asm.old_id AND m_asm.table_name = 'assemblies'
+        WHERE m_asm.old_id IS NULL
+        ORDER BY a.old_id
+    """)
+    new_asm_old_ids = [row[0] for row in cur.fetchall()]
+    if new_asm_old_ids:
+        new_asm_ids = allocate_ids(cur, 'repositories.assembly', 'assm_id', len(new_asm_old_ids))
+        cur.execute("""
+            INSERT INTO repositories.assembly (assm_id, assm_date_created, assm_desc, prj_id, assm_version)
+            SELECT n.new_id,
+                   COALESCE(to_timestamp(NULLIF(a.time, 0)), NOW()),
+                   COALESCE(a.description, 'No description'),
+                   m_proj.new_id,
+                   ' '
+            FROM unnest(%s::integer[], %s::integer[]) AS n(old_id, new_id)
+            JOIN staging.assemblies a ON a.old_id = n.old_id
+            JOIN id_mappings m_proj ON a.prj_ref = m_proj.old_id AND m_proj.table_name = 'projects'
+        """, (new_asm_old_ids, new_asm_ids))
+        for old_id, new_id in zip(new_asm_old_ids, new_asm_ids):
+            id_mapper.add_mapping('assemblies', old_id, new_id)
+        logger.info(f"Обработано новых сборок: {len(new_asm_ids)}")
+        return len(new_asm_ids)
+    logger.info("Новых сборок для обработки нет")
+    return 0
+
+
+def process_src_packages(cur, id_mapper):
+    """
+    Обработка src_packages – уникальные имена upsert-ятся одним запросом,
+    затем результат соединяется со staging, чтобы все old_id с одинаковым именем
+    получили один и тот же pkg_id.
+    """
+    logger.info("Обработка исходных пакетов (src_packages) – вставляем только новые записи")
+    reject_staging_rows(cur, 'src_packages', 'null_name', """
+        FROM staging.src_packages s
+        LEFT JOIN id_mappings m ON s.old_id = m.old_id AND m.table_name = 'src_packages'
+        WHERE s.name IS NULL AND m.old_id IS NULL
+    """)
+    cur.execute("""
+        WITH new_src AS (
+            SELECT s.old_id, s.name
+            FROM staging.src_packages s
+            LEFT JOIN id_mappings m ON s.old_id = m.old_id AND m.table_name = 'src_packages'
+            WHERE s.name IS NOT NULL AND m.old_id IS NULL
+        ),
+        upserted AS (
+            INSERT INTO repositories.package (pkg_name)
+            SELECT DISTINCT name FROM new_src
+            ON CONFLICT (pkg_name) DO UPDATE SET pkg_name = EXCLUDED.pkg_name
+            RETURNING pkg_id, pkg_name
+        )
+        SELECT n.old_id, u.pkg_id
+        FROM new_src n
+        JOIN upserted u ON u.pkg_name = n.name
+        ORDER BY n.old_id
+    """)
+    src_mapping = cur.fetchall()
+    if src_mapping:
+        for old_id, pkg_id in src_mapping:
+            id_mapper.add_mapping('src_packages', old_id, pkg_id)
+        logger.info(f"Обработано новых src_packages: {len(src_mapping)}")
+    else:
+        logger.info("Новых src_packages для обработки нет")
+    return len(src_mapping)
+
+
+def process_pkg_versions(cur, id_mapper):
+    """
+    Обработка pkg_versions – одним запросом: src_pkg_ref разрешается через id_mappings,
+    новые версии вставляются, а для уже существующих (version, pkg_id) берётся их pkg_vrs_id.
+    """
+    logger.info("Обработка версий пакетов (pkg_versions) – вставляем только новые записи")
+    reject_staging_rows(cur, 'pkg_versions', 'missing_src_package', """
+        FROM staging.pkg_versions s
+        LEFT JOIN id_mappings m_pkg ON s.src_pkg_ref = m_pkg.old_id AND m_pkg.table_name = 'src_packages'
+        LEFT JOIN id_mappings m_ver ON s.old_id = m_ver.old_id AND m_ver.table_name = 'pkg_versions'
+        WHERE m_ver.old_id IS NULL AND m_pkg.old_id IS NULL
+    """)
+    cur.execute("""
+        WITH new_data AS (
+            SELECT pv.old_id,
+                   COALESCE(to_timestamp(NULLIF(pv.time, 0)), NOW()) AS pkg_date_created,
+                   NULLIF(pv.maintainer, '') AS author_name,
+                   m_pkg.new_id AS pkg_id,
+                   COALESCE(NULLIF(pv.version, ''), '0.0.0') AS version
+            FROM staging.pkg_versions pv
+            INNER JOIN id_mappings m_pkg ON pv.src_pkg_ref = m_pkg.old_id AND m_pkg.table_name = 'src_packages'
+            LEFT JOIN id_mappings m_ver ON pv.old_id = m_ver.old_id AND m_ver.table_name = 'pkg_versions'
+            WHERE m_ver.old_id IS NULL
+        ),
+        inserted_versions AS (
+            INSERT INTO repositories.pkg_version (pkg_date_created, author_name, pkg_id, version)
+            SELECT DISTINCT ON (pkg_id, version) pkg_date_created, author_name, pkg_id, version
+            FROM new_data
+            ORDER BY pkg_id, version, old_id
+            ON CONFLICT (version, pkg_id) DO NOTHING
+            RETURNING pkg_vrs_id, pkg_id, version
+        )
+        SELECT nd.old_id, COALESCE(iv.pkg_vrs_id, ev.pkg_vrs_id)
+        FROM new_data nd
+        LEFT JOIN inserted_versions iv ON iv.pkg_id = nd.pkg_id AND iv.version = nd.version
+        LEFT JOIN repositories.pkg_version ev ON ev.pkg_id = nd.pkg_id AND ev.version = nd.version
+        ORDER BY nd.old_id
+    """)
+    versions_mapping = cur.fetchall()
+    processed_versions = 0
+    for old_id, pkg_vrs_id in versions_mapping:
+        if pkg_vrs_id is not None:
+            id_mapper.add_mapping('pkg_versions', old_id, pkg_vrs_id)
+            processed_versions += 1
+    if versions_mapping:
+        logger.info(f"Обработано новых pkg_versions: {processed_versions}")
+    else:
+        logger.info("Новых pkg_versions для обработки нет")
+    return processed_versions
+
+
+def process_urgency(cur, id_mapper):
+    """
+    Обработка urgency.
+    """
+    logger.info("Обработка urgency – вставляем только новые записи")
+    reject_staging_rows(cur, 'urgency', 'null_name', """
+        FROM staging.urgency s
+        LEFT JOIN id_mappings m ON s.old_id = m.old_id AND m.table_name = 'urgency'
+        WHERE s.name IS NULL AND m.old_id IS NULL
+    """)
+    cur.execute("""
+        SELECT s.old_id
+        FROM staging.urgency s
+        LEFT JOIN id_mappings m ON s.old_id = m.old_id AND m.table_name = 'urgency'
+        WHERE s.name IS NOT NULL AND m.old_id IS NULL
+        ORDER BY s.old_id
+    """)
+    new_urg_old_ids = [row[0] for row in cur.fetchall()]
+    if new_urg_old_ids:
+        new_urg_ids = allocate_ids(cur, 'repositories.urgency', 'urg_id', len(new_urg_old_ids))
+        cur.execute("""
+            INSERT INTO repositories.urgency (urg_id, urg_name)
+            SELECT n.new_id, s.name
+            FROM unnest(%s::integer[], %s::integer[]) AS n(old_id, new_id)
+            JOIN staging.urgency s ON s.old_id = n.old_id
+        """, (new_urg_old_ids, new_urg_ids))
+        for old_id, new_id in zip(new_urg_old_ids, new_urg_ids):
+            id_mapper.add_mapping('urgency', old_id, new_id)
+        logger.info(f"Обработано новых urgency: {len(new_urg_ids)}")
+        return len(new_urg_ids)
+    logger.info("Новых urgency для обработки нет")
+    return 0
+
+
+def process_vulnerabilities(cur, id_mapper):
+    """
+    Обработка vulnerabilities.
+    """
+    logger.info("Обработка vulnerabilities – вставляем только новые записи")
+    reject_staging_rows(cur, 'vulnerabilities', 'null_name', """
+        FROM staging.vulnerabilities s
+        LEFT JOIN id_mappings m ON s.old_id = m.old_id AND m.table_name = 'vulnerabilities'
+        WHERE s.name IS NULL AND m.old_id IS NULL
+    """)
+    cur.execute("""
+        SELECT s.old_id
+        FROM staging.vulnerabilities s
+        LEFT JOIN id_mappings m ON s.old_id = m.old_id AND m.table_name = 'vulnerabilities'
+        WHERE s.name IS NOT NULL AND m.old_id IS NULL
+        ORDER BY s.old_id
+    """)
+    new_vuln_old_ids = [row[0] for row in cur.fetchall()]
+    if new_vuln_old_ids:
+        new_vuln_ids = allocate_ids(cur, 'repositories.vulnerabilities', 'id', len(new_vuln_old_ids))
+        cur.execute("""
+            INSERT INTO repositories.vulnerabilities (id, name)
+            SELECT n.new_id, s.name
+            FROM unnest(%s::integer[], %s::integer[]) AS n(old_id, new_id)
+            JOIN staging.vulnerabilities s ON s.old_id = n.old_id
+        """, (new_vuln_old_ids, new_vuln_ids))
+        for old_id, new_id in zip(new_vuln_old_ids, new_vuln_ids):
+            id_mapper.add_mapping('vulnerabilities', old_id, new_id)
+        logger.info(f"Обработано новых vulnerabilities: {len(new_vuln_ids)}")
+        return len(new_vuln_ids)
+    logger.info("Новых vulnerabilities для обработки нет")
+    return 0
+
+
+def process_assembly_links(cur, id_mapper):
+    """
+    Обработка связей assembly-package.
+    """
+    logger.info("Обработка связей assembly-package")
+    reject_staging_rows(cur, 'asm_pkg_vsn_lnk', 'missing_assembly_or_pkg_version', """
+        FROM staging.asm_pkg_vsn_lnk s
+        LEFT JOIN id_mappings a ON s.asm_ref = a.old_id AND a.table_name = 'assemblies'
+        LEFT JOIN id_mappings p ON s.pkg_vsn_ref = p.old_id AND p.table_name = 'pkg_versions'
+        WHERE a.old_id IS NULL OR p.old_id IS NULL
+    """)
+    cur.execute("""
+        INSERT INTO repositories.assm_pkg_vrs (assm_id, pkg_vrs_id)
+        SELECT a.new_id, p.new_id
+        FROM staging.asm_pkg_vsn_lnk l
+        JOIN id_mappings a ON l.asm_ref = a.old_id AND a.table_name = 'assemblies'
+        JOIN id_mappings p ON l.pkg_vsn_ref = p.old_id AND p.table_name = 'pkg_versions'
+        WHERE NOT EXISTS (
+            SELECT 1 FROM repositories.assm_pkg_vrs ap
+            WHERE ap.assm_id = a.new_id AND ap.pkg_vrs_id = p.new_id
+        )
+    """)
+    logger.info(f"Добавлено связей assembly-package: {cur.rowcount}")
+    return cur.rowcount
+
+
+def process_changes(cur, id_mapper):
+    """
+    Обработка changelog (changes) – одной вставкой. Новые id выдаются через nextval
+    до INSERT, поэтому соответствие old_id -> id известно точно.
+    Версия пакета могла быть перенесена прошлым запуском и отсутствовать в staging –
+    тогда дата берётся из repositories.pkg_version.
+    """
+    logger.info("Обработка changelog (changes) – вставляем только новые записи")
+    reject_staging_rows(cur, 'changes', 'missing_pkg_version', """
+        FROM staging.changes s
+        LEFT JOIN id_mappings p ON s.pkg_vsn_ref = p.old_id AND p.table_name = 'pkg_versions'
+        LEFT JOIN id_mappings m ON s.old_id = m.old_id AND m.table_name = 'changes'
+        WHERE p.old_id IS NULL AND m.old_id IS NULL
+    """)
+    cur.execute("""
+        WITH changelog_data AS (
+            SELECT c.old_id,
+                   nextval(pg_get_serial_sequence('repositories.changelog', 'id')) AS new_id,
+                   COALESCE(c.special, '') AS log_desc,
+                   p.new_id AS pkg_vrs_id,
+                   CASE
+                       WHEN pv.old_id IS NOT NULL THEN COALESCE(to_timestamp(NULLIF(pv.time, 0)), NOW())
+                       ELSE rv.pkg_date_created
+                   END AS date_added
+            FROM staging.changes c
+            INNER JOIN id_mappings p ON c.pkg_vsn_ref = p.old_id AND p.table_name = 'pkg_versions'
+            LEFT JOIN id_mappings m ON c.old_id = m.old_id AND m.table_name = 'changes'
+            LEFT JOIN staging.pkg_versions pv ON c.pkg_vsn_ref = pv.old_id
+            JOIN repositories.pkg_version rv ON rv.pkg_vrs_id = p.new_id
+            WHERE m.old_id IS NULL
+        ),
+        inserted_changes AS (
+            INSERT INTO repositories.changelog (id, log_desc, pkg_vrs_id, date_added, log_ident)
+            SELECT new_id, log_desc, pkg_vrs_id, date_added, ''
+            FROM changelog_data
+            RETURNING id
+        )
+        SELECT cd.old_id, cd.new_id
+        FROM changelog_data cd
+        JOIN inserted_changes ic ON ic.id = cd.new_id
+    """)
+    changes_mapping = cur.fetchall()
+    for old_id, new_chg_id in changes_mapping:
+        id_mapper.add_mapping('changes', old_id, new_chg_id)
+    logger.info(f"Обработано новых записей changelog: {len(changes_mapping)}")
+    return len(changes_mapping)
+
+
+# Шаги обработки staging в порядке зависимостей по внешним ключам;
+# каждый шаг возвращает количество обработанных строк
+PROCESSING_STEPS = [
+    ('projects', process_projects),
+    ('assemblies', process_assemblies),
+    ('src_packages', process_src_packages),
+    ('pkg_versions', process_pkg_versions),
+    ('urgency', process_urgency),
+    ('vulnerabilities', process_vulnerabilities),
+    ('assm_pkg_vrs', process_assembly_links),
+    ('changes', process_changes),
+]
+
+
+def process_staging_data(pg_conn, id_mapper, completed=()):
+    """
+    Обработка данных из staging и перенос в основные таблицы.
+    Каждый шаг PROCESSING_STEPS фиксируется одной транзакцией вместе со своими маппингами
+    и записью в migration_ledger; шаги из completed (прерванный запуск) пропускаются.
+    """
+    logger.info("Начало обработки данных из staging")
+    check_staging_complete(pg_conn)
+    try:
+        with pg_conn.cursor() as cur:
+            for step, process_step in PROCESSING_STEPS:
+                ledger_step = f"process:{step}"
+                if ledger_step in completed:
+                    logger.info(f"Шаг {step} уже выполнен, пропуск")
+                    continue
+                with metrics.stage(ledger_step) as stage:
+                    stage['rows'] = process_step(cur, id_mapper)
+                record_step(cur, ledger_step)
+                update_id_mappings(pg_conn, id_mapper)
+                pg_conn.commit()
             logger.info("Обработка данных успешно завершена")
     except Exception as e:
         pg_conn.rollback()
@@ -601,36 +1111,70 @@ def process_staging_data(pg_conn, id_mapper):
         raise
 
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Инкрементальная миграция SQLite -> PostgreSQL через staging")
+    parser.add_argument(
+        '--resume', action='store_true',
+        help="продолжить прерванный запуск: использовать сохранённый staging и пропустить завершённые шаги"
+    )
+    return parser.parse_args()
+
+
 def main():
+    args = parse_args()
+    setup_logging(LOG_FILE, sys.stdout, LOG_FORMAT)
     pg_conn = None
     sqlite_conn = None
+    succeeded = False
     try:
         logger.info("=== НАЧАЛО МИГРАЦИИ (инкрементальная) ===")
         logger.info(f"Подключение к SQLite: {SQLITE_DB}")
         sqlite_conn = sqlite3.connect(SQLITE_DB)
         logger.info("Подключение к PostgreSQL")
-        pg_conn = psycopg2.connect(**POSTGRES_CONFIG)
+        pg_conn = psycopg2.connect(**POSTGRES_CONFIG, cursor_factory=metrics.cursor_factory())
         pg_conn.autocommit = False
-        logger.info("Инициализация временной схемы (staging)")
-        setup_postgres_schemas(pg_conn)
-        id_mapper = IdMapper()
-        load_existing_mappings(pg_conn, id_mapper)
+        setup_id_mappings(pg_conn)
+        setup_watermarks(pg_conn)
+        setup_rejects(pg_conn)
+        setup_ledger(pg_conn)
+        ledger = load_ledger(pg_conn) if args.resume else {}
+        if ledger:
+            logger.info(f"Продолжение прерванного запуска, выполнено шагов: {len(ledger) - 1}")
+            bounds = {table: tuple(rowid_range) if rowid_range else None
+                      for table, rowid_range in ledger['bounds'].items()}
+        else:
+            if args.resume:
+                logger.warning("Прерванного запуска нет или staging потерян, выполняется новый запуск")
+            logger.info("Инициализация временной схемы (staging)")
+            setup_postgres_schemas(pg_conn)
+            watermarks = load_watermarks(pg_conn) if INCREMENTAL_EXTRACT else {}
+            bounds = get_extraction_bounds(sqlite_conn, watermarks)
+            start_run(pg_conn, bounds)
         logger.info("Этап 1: Перенос данных в staging")
-        id_mapper = migrate_to_staging(sqlite_conn, pg_conn)
+        id_mapper = migrate_to_staging(sqlite_conn, pg_conn, bounds, completed=ledger)
+        if RETRY_REJECTS and 'staging:rejects' not in ledger:
+            restage_rejects(pg_conn)
         logger.info("Этап 2: Обработка данных из staging и перенос в основную схему")
-        process_staging_data(pg_conn, id_mapper)
+        process_staging_data(pg_conn, id_mapper, completed=ledger)
+        save_watermarks(pg_conn, bounds)
+        if RETRY_REJECTS:
+            purge_retried_rejects(pg_conn)
+        succeeded = True
         logger.info("=== МИГРАЦИЯ ЗАВЕРШЕНА УСПЕШНО ===")
     except Exception as e:
         logger.error(f"КРИТИЧЕСКАЯ ОШИБКА: {e}")
         sys.exit(1)
     finally:
-        logger.info("Начало очистки временной схемы (staging)")
         if pg_conn:
             try:
-                with pg_conn.cursor() as cur:
-                    cur.execute("DROP SCHEMA IF EXISTS staging CASCADE")
-                pg_conn.commit()
-                logger.info("Временная схема staging успешно удалена")
+                if succeeded:
+                    logger.info("Начало очистки временной схемы (staging)")
+                    with pg_conn.cursor() as cur:
+                        cur.execute("DROP SCHEMA IF EXISTS staging CASCADE")
+                    pg_conn.commit()
+                    logger.info("Временная схема staging успешно удалена")
+                else:
+                    logger.info("Схема staging сохранена для продолжения запуска (--resume)")
             except Exception as cleanup_error:
                 logger.error(f"Ошибка при удалении временной схемы: {cleanup_error}", exc_info=True)
             finally:
@@ -639,6 +1183,7 @@ def main():
         if sqlite_conn:
             sqlite_conn.close()
             logger.info("Соединение с SQLite закрыто")
+        metrics.write_summary(METRICS_PATH)
 
 
 if __name__ == "__main__":
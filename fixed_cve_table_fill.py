@@ -1,128 +1,545 @@
+import argparse
+import os
 import psycopg2
 import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from psycopg2.extras import execute_values
 
-# Параметры подключения к БД
+from stage_metrics import StageMetrics
+
+# Параметры подключения к БД (переменные окружения MIGRATION_PG_* переопределяют значения по умолчанию)
 DB_CONFIG = {
-    'dbname': 'uroboros',
-    'user': 'owner',
-    'password': '1111',
-    'host': 'localhost',
-    'port': 5432
+    'dbname': os.environ.get('MIGRATION_PG_DBNAME', 'uroboros'),
+    'user': os.environ.get('MIGRATION_PG_USER', 'owner'),
+    'password': os.environ.get('MIGRATION_PG_PASSWORD', '1111'),
+    'host': os.environ.get('MIGRATION_PG_HOST', 'localhost'),
+    'port': os.environ.get('MIGRATION_PG_PORT', 5432)
 }
 
 # Регулярное выражение для поиска CVE-идентификаторов по шаблону CVE-YYYY-NNNN
 CVE_PATTERN = re.compile(r'CVE-\d{4}-\d{4,7}')
 
+# Размер порции при потоковом чтении changelog через серверный курсор
+CHANGELOG_CHUNK_SIZE = 10000
+
+# Количество процессов для поиска CVE в changelog (1 — поиск в основном процессе)
+SCAN_WORKERS = 1
+
+# Множество версий для пересчёта: все версии из assm_pkg_vrs или (режим --incremental)
+# временная таблица с версиями, затронутыми после прошлого запуска
+FULL_SCOPE = 'repositories.assm_pkg_vrs'
+INCREMENTAL_SCOPE = 'fixed_cve_scope'
+
+# JSON-сводка по этапам (время, строки, трафик, пиковый RSS)
+METRICS_PATH = 'fixed_cve_metrics.json'
+
+metrics = StageMetrics('fixed_cve_table_fill')
+
+
+def iter_changelog_chunks(conn, scope=FULL_SCOPE):
+    """
+    Потоковое чтение changelog для версий из scope через именованный (серверный)
+    курсор порциями по CHANGELOG_CHUNK_SIZE строк: в памяти одновременно только одна порция.
+    Строки идут по возрастанию id, поэтому первое найденное вхождение — запись с минимальным id.
+    """
+    with conn.cursor(name='changelog_stream') as cur:
+        cur.itersize = CHANGELOG_CHUNK_SIZE
+        cur.execute(f"""
+            SELECT c.id, c.pkg_vrs_id, c.log_desc
+            FROM repositories.changelog c
+            WHERE EXISTS (
+                SELECT 1 FROM {scope} a WHERE a.pkg_vrs_id = c.pkg_vrs_id
+            )
+            ORDER BY c.id;
+        """)
+        while True:
+            rows = cur.fetchmany(CHANGELOG_CHUNK_SIZE)
+            if not rows:
+                break
+            yield rows
+
+
+def extract_cve_hits(rows):
+    """
+    Поиск CVE в порции строк changelog (id, pkg_vrs_id, log_desc); выполняется и в процессах пула.
+    Возвращает компактные кортежи (changelog_id, pkg_vrs_id, cve) в порядке строк порции
+    и минимальный id записи changelog по каждой версии порции.
+    """
+    hits = []
+    min_ids = {}
+    for changelog_id, pkg_vrs, log_desc in rows:
+        if pkg_vrs not in min_ids or changelog_id < min_ids[pkg_vrs]:
+            min_ids[pkg_vrs] = changelog_id
+        if not log_desc:
+            continue
+        for cve in set(CVE_PATTERN.findall(log_desc)):
+            hits.append((changelog_id, pkg_vrs, cve))
+    return hits, min_ids
+
+
+def merge_cve_hits(hits, min_ids, vuln_map, upsert_data, changelog_pk_map):
+    """
+    Сливает результат extract_cve_hits: обновляет минимальный id записи changelog по версии
+    (позже используется для fixed_tracker_string_number) и добавляет в upsert_data
+    первое вхождение каждой пары (pkg_vrs_id, vulnerability_id).
+    Порции должны сливаться в порядке чтения, тогда первое вхождение — минимальный id.
+    """
+    for pkg_vrs, changelog_id in min_ids.items():
+        if pkg_vrs not in changelog_pk_map or changelog_id < changelog_pk_map[pkg_vrs]:
+            changelog_pk_map[pkg_vrs] = changelog_id
+    for changelog_id, pkg_vrs, cve in hits:
+        vulnerability_id = vuln_map.get(cve)
+        if vulnerability_id is None:
+            print(f"Предупреждение: {cve} не найден в vulnerabilities (changelog id: {changelog_id}).")
+            continue
+        key = (pkg_vrs, vulnerability_id)
+        if key not in upsert_data:
+            upsert_data[key] = {
+                'changelog_string_number': changelog_id,
+                'fixed_tracker_string_number': None
+            }
+
+
+def scan_changelog(chunks, vuln_map, upsert_data, changelog_pk_map, workers=SCAN_WORKERS, on_hits=None):
+    """
+    Поиск CVE по порциям changelog. При workers > 1 порции обрабатываются пулом процессов;
+    в работе одновременно не больше 2 * workers порций, результаты сливаются строго в порядке
+    порций, поэтому upsert_data совпадает с последовательным поиском.
+    on_hits, если задан, получает найденные в порции упоминания (changelog_id, pkg_vrs_id, cve)
+    перед слиянием, в том же порядке порций.
+
+    :return: Количество просмотренных строк changelog.
+    """
+    def merge(hits, min_ids):
+        if on_hits is not None:
+            on_hits(hits)
+        merge_cve_hits(hits, min_ids, vuln_map, upsert_data, changelog_pk_map)
+
+    scanned = 0
+    if workers <= 1:
+        for rows in chunks:
+            merge(*extract_cve_hits(rows))
+            scanned += len(rows)
+        return scanned
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for rows in chunks:
+            pending.append(pool.submit(extract_cve_hits, rows))
+            scanned += len(rows)
+            if len(pending) >= workers * 2:
+                merge(*pending.popleft().result())
+        while pending:
+            merge(*pending.popleft().result())
+    return scanned
+
+
+# Заполнение fixed_cve_status одним запросом на стороне PostgreSQL (режим --pushdown).
+# Повторяет логику Python-пути: changelog_string_number — минимальный id записи changelog,
+# в которой найден CVE; fixed_tracker_string_number — минимальный id записи changelog версии
+# для пар из debtracker; учитываются только версии из {scope} (по умолчанию assm_pkg_vrs).
+# {store_hits} — пусто или STORE_HITS_CTE (режим --incremental).
+PUSHDOWN_UPSERT_QUERY = """
+    WITH repo_versions AS (
+        SELECT DISTINCT pkg_vrs_id FROM {scope}
+    ),
+    vulns AS (
+        -- При повторяющихся именах берётся наибольший id, как в vuln_map Python-пути
+        SELECT name, MAX(id) AS id FROM repositories.vulnerabilities GROUP BY name
+    ),
+    changelog_first AS (
+        SELECT c.pkg_vrs_id, MIN(c.id) AS first_id
+        FROM repositories.changelog c
+        JOIN repo_versions r ON r.pkg_vrs_id = c.pkg_vrs_id
+        GROUP BY c.pkg_vrs_id
+    ),
+    changelog_hits AS (
+        SELECT DISTINCT c.id AS changelog_id, c.pkg_vrs_id, m.cve[1] AS cve_name
+        FROM repositories.changelog c
+        JOIN repo_versions r ON r.pkg_vrs_id = c.pkg_vrs_id
+        CROSS JOIN LATERAL regexp_matches(c.log_desc, %(pattern)s, 'g') AS m(cve)
+    ),{store_hits}
+    changelog_cves AS (
+        SELECT h.pkg_vrs_id, v.id AS vulnerability_id, MIN(h.changelog_id) AS changelog_string_number
+        FROM changelog_hits h
+        JOIN vulns v ON v.name = h.cve_name
+        GROUP BY h.pkg_vrs_id, v.id
+    ),
+    tracker AS (
+        SELECT DISTINCT pv.pkg_vrs_id, v.id AS vulnerability_id
+        FROM debtracker.cve dc
+        JOIN debtracker.cve_rep cr ON dc.cve_id = cr.cve_id
+        JOIN debtracker.pkg_version dpv ON dpv.pkg_vrs_id = cr.fixed_pkg_vrs_id
+        JOIN debtracker.package dp ON dp.pkg_id = dpv.pkg_id
+        JOIN repositories.package p ON p.pkg_name = dp.pkg_name
+        JOIN repositories.pkg_version pv ON pv.pkg_id = p.pkg_id AND pv.version = dpv.version
+        JOIN repo_versions r ON r.pkg_vrs_id = pv.pkg_vrs_id
+        JOIN vulns v ON v.name = dc.cve_name
+    )
+    INSERT INTO repositories.fixed_cve_status
+        (pkg_vrs_id, vulnerability_id, changelog_string_number, fixed_tracker_string_number, manual_input_user_id)
+    SELECT COALESCE(cc.pkg_vrs_id, t.pkg_vrs_id),
+           COALESCE(cc.vulnerability_id, t.vulnerability_id),
+           cc.changelog_string_number,
+           CASE WHEN t.pkg_vrs_id IS NOT NULL THEN cf.first_id END,
+           NULL
+    FROM changelog_cves cc
+    FULL JOIN tracker t ON t.pkg_vrs_id = cc.pkg_vrs_id AND t.vulnerability_id = cc.vulnerability_id
+    LEFT JOIN changelog_first cf ON cf.pkg_vrs_id = COALESCE(cc.pkg_vrs_id, t.pkg_vrs_id)
+    ON CONFLICT (pkg_vrs_id, vulnerability_id)
+    DO UPDATE SET
+        changelog_string_number = COALESCE(repositories.fixed_cve_status.changelog_string_number, EXCLUDED.changelog_string_number),
+        fixed_tracker_string_number = COALESCE(repositories.fixed_cve_status.fixed_tracker_string_number, EXCLUDED.fixed_tracker_string_number)
+"""
+
+# Сохранение найденных упоминаний в fixed_cve_hits тем же запросом (CTE с INSERT выполняется
+# всегда, даже если на него никто не ссылается)
+STORE_HITS_CTE = """
+    stored_hits AS (
+        INSERT INTO fixed_cve_hits (changelog_id, pkg_vrs_id, cve_name)
+        SELECT changelog_id, pkg_vrs_id, cve_name FROM changelog_hits
+        ON CONFLICT (changelog_id, cve_name) DO NOTHING
+    ),"""
+
+
+def fill_fixed_cve_pushdown(cur, scope=FULL_SCOPE, store_hits=False):
+    """
+    Поиск CVE (regexp_matches по CVE_PATTERN), сопоставление с vulnerabilities, версиями scope
+    и debtracker и upsert в fixed_cve_status одним запросом: тексты changelog не передаются
+    клиенту. При store_hits найденные упоминания этим же запросом сохраняются в fixed_cve_hits.
+    Возвращает количество вставленных/обновлённых записей.
+    """
+    query = PUSHDOWN_UPSERT_QUERY.format(scope=scope, store_hits=STORE_HITS_CTE if store_hits else '')
+    cur.execute(query, {'pattern': CVE_PATTERN.pattern})
+    return cur.rowcount
+
+
+def store_cve_hits(cur, hits):
+    """
+    Сохраняет упоминания (changelog_id, pkg_vrs_id, cve) из extract_cve_hits в fixed_cve_hits.
+    """
+    if hits:
+        execute_values(cur, """
+            INSERT INTO fixed_cve_hits (changelog_id, pkg_vrs_id, cve_name)
+            VALUES %s
+            ON CONFLICT (changelog_id, cve_name) DO NOTHING
+        """, hits, page_size=1000)
+
+
+def setup_incremental_state(conn):
+    """
+    Создаёт таблицы состояния режима --incremental:
+    fixed_cve_state — водяные знаки прошлого запуска (максимальные id changelog и vulnerabilities,
+    отпечаток debtracker), fixed_cve_versions — версии, уже обработанные прошлыми запусками,
+    fixed_cve_hits — упоминания CVE в changelog до водяного знака (в том числе CVE,
+    которых ещё нет в vulnerabilities): записи обработанных версий сохраняет сам поиск
+    (scan_changelog или --pushdown), новые записи остальных версий — update_cve_hits.
+    """
+    with conn.cursor() as cur:
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS fixed_cve_state (
+                id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+                max_changelog_id BIGINT NOT NULL,
+                max_vulnerability_id BIGINT NOT NULL,
+                debtracker_state TEXT NOT NULL,
+                updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+            )
+        """)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS fixed_cve_versions (
+                pkg_vrs_id INTEGER PRIMARY KEY
+            )
+        """)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS fixed_cve_hits (
+                changelog_id BIGINT NOT NULL,
+                pkg_vrs_id INTEGER,
+                cve_name TEXT NOT NULL,
+                PRIMARY KEY (changelog_id, cve_name)
+            )
+        """)
+        cur.execute("CREATE INDEX IF NOT EXISTS fixed_cve_hits_cve_name_idx ON fixed_cve_hits (cve_name)")
+    conn.commit()
+
+
+def read_current_state(cur):
+    """
+    Текущее состояние источников: максимальные id changelog и vulnerabilities и md5-отпечаток
+    пар (cve_name, version, pkg_name) debtracker, вычисляемый на стороне сервера.
+    """
+    cur.execute("""
+        SELECT
+            (SELECT COALESCE(MAX(id), 0) FROM repositories.changelog),
+            (SELECT COALESCE(MAX(id), 0) FROM repositories.vulnerabilities),
+            (SELECT COALESCE(md5(string_agg(t.entry, ',' ORDER BY t.entry)), '')
+             FROM (
+                 SELECT concat_ws('|', dc.cve_name, pv.version, p.pkg_name) AS entry
+                 FROM debtracker.cve dc
+                 JOIN debtracker.cve_rep cr ON dc.cve_id = cr.cve_id
+                 JOIN debtracker.pkg_version pv ON pv.pkg_vrs_id = cr.fixed_pkg_vrs_id
+                 JOIN debtracker.package p ON p.pkg_id = pv.pkg_id
+             ) t);
+    """)
+    max_changelog_id, max_vulnerability_id, debtracker_state = cur.fetchone()
+    return {
+        'max_changelog_id': max_changelog_id,
+        'max_vulnerability_id': max_vulnerability_id,
+        'debtracker_state': debtracker_state,
+    }
+
+
+def load_saved_state(cur):
+    """
+    Состояние, сохранённое прошлым запуском в режиме --incremental, или None.
+    """
+    cur.execute("SELECT max_changelog_id, max_vulnerability_id, debtracker_state FROM fixed_cve_state;")
+    row = cur.fetchone()
+    if row is None:
+        return None
+    return {'max_changelog_id': row[0], 'max_vulnerability_id': row[1], 'debtracker_state': row[2]}
+
+
+def update_cve_hits(cur, saved, state):
+    """
+    Дополняет fixed_cve_hits упоминаниями CVE из записей changelog, добавленных после
+    прошлого запуска (id выше сохранённого водяного знака и не выше прочитанного в начале
+    запуска). Поиск выполняется на стороне сервера. Без сохранённого состояния не вызывается:
+    первый запуск заполняет fixed_cve_hits результатами основного поиска.
+    Выполняется в одной транзакции с сохранением состояния.
+    Возвращает количество добавленных упоминаний.
+    """
+    cur.execute("""
+        INSERT INTO fixed_cve_hits (changelog_id, pkg_vrs_id, cve_name)
+        SELECT DISTINCT c.id, c.pkg_vrs_id, m.cve[1]
+        FROM repositories.changelog c
+        CROSS JOIN LATERAL regexp_matches(c.log_desc, %(pattern)s, 'g') AS m(cve)
+        WHERE c.id > %(from_id)s AND c.id <= %(to_id)s
+        ON CONFLICT (changelog_id, cve_name) DO NOTHING;
+    """, {
+        'from_id': saved['max_changelog_id'],
+        'to_id': state['max_changelog_id'],
+        'pattern': CVE_PATTERN.pattern,
+    })
+    return cur.rowcount
+
+
+def prepare_incremental_scope(cur, saved, state):
+    """
+    Заполняет временную таблицу INCREMENTAL_SCOPE версиями из assm_pkg_vrs, которые нужно
+    пересчитать: версии, ещё не обработанные прошлыми запусками; версии с новыми записями
+    changelog (id выше водяного знака); версии, в changelog которых упоминаются уязвимости,
+    добавленные после прошлого запуска (по fixed_cve_hits, без повторного поиска по changelog);
+    версии, которые debtracker сопоставляет с такими уязвимостями.
+    Таблица удаляется при COMMIT. Возвращает количество версий.
+    """
+    cur.execute(f"""
+        CREATE TEMP TABLE {INCREMENTAL_SCOPE} (
+            pkg_vrs_id INTEGER PRIMARY KEY
+        ) ON COMMIT DROP;
+    """)
+    cur.execute(f"""
+        INSERT INTO {INCREMENTAL_SCOPE} (pkg_vrs_id)
+        SELECT s.pkg_vrs_id
+        FROM (
+            SELECT a.pkg_vrs_id
+            FROM repositories.assm_pkg_vrs a
+            WHERE NOT EXISTS (SELECT 1 FROM fixed_cve_versions f WHERE f.pkg_vrs_id = a.pkg_vrs_id)
+            UNION
+            SELECT c.pkg_vrs_id
+            FROM repositories.changelog c
+            WHERE c.id > %(max_changelog_id)s
+            UNION
+            SELECT h.pkg_vrs_id
+            FROM fixed_cve_hits h
+            JOIN repositories.vulnerabilities v ON v.name = h.cve_name
+            WHERE v.id > %(max_vulnerability_id)s
+            UNION
+            SELECT pv.pkg_vrs_id
+            FROM debtracker.cve dc
+            JOIN repositories.vulnerabilities v ON v.name = dc.cve_name
+            JOIN debtracker.cve_rep cr ON dc.cve_id = cr.cve_id
+            JOIN debtracker.pkg_version dpv ON dpv.pkg_vrs_id = cr.fixed_pkg_vrs_id
+            JOIN debtracker.package dp ON dp.pkg_id = dpv.pkg_id
+            JOIN repositories.package p ON p.pkg_name = dp.pkg_name
+            JOIN repositories.pkg_version pv ON pv.pkg_id = p.pkg_id AND pv.version = dpv.version
+            WHERE v.id > %(max_vulnerability_id)s
+        ) s
+        WHERE EXISTS (SELECT 1 FROM repositories.assm_pkg_vrs a WHERE a.pkg_vrs_id = s.pkg_vrs_id);
+    """, {
+        'max_changelog_id': saved['max_changelog_id'],
+        'max_vulnerability_id': saved['max_vulnerability_id'],
+    })
+    return cur.rowcount
+
+
+def save_incremental_state(cur, state, scope):
+    """
+    Сохраняет состояние, прочитанное в начале запуска, и отмечает версии scope обработанными.
+    Выполняется в одной транзакции с upsert в fixed_cve_status.
+    """
+    cur.execute("""
+        INSERT INTO fixed_cve_state (id, max_changelog_id, max_vulnerability_id, debtracker_state)
+        VALUES (TRUE, %(max_changelog_id)s, %(max_vulnerability_id)s, %(debtracker_state)s)
+        ON CONFLICT (id) DO UPDATE
+        SET max_changelog_id = EXCLUDED.max_changelog_id,
+            max_vulnerability_id = EXCLUDED.max_vulnerability_id,
+            debtracker_state = EXCLUDED.debtracker_state,
+            updated_at = NOW();
+    """, state)
+    cur.execute(f"""
+        INSERT INTO fixed_cve_versions (pkg_vrs_id)
+        SELECT DISTINCT pkg_vrs_id FROM {scope}
+        ON CONFLICT (pkg_vrs_id) DO NOTHING;
+    """)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Заполнение repositories.fixed_cve_status")
+    parser.add_argument(
+        '--workers', type=int, default=SCAN_WORKERS,
+        help="количество процессов для поиска CVE в changelog (1 — без пула процессов)"
+    )
+    parser.add_argument(
+        '--pushdown', action='store_true',
+        help="искать CVE и заполнять fixed_cve_status одним запросом на стороне PostgreSQL"
+    )
+    parser.add_argument(
+        '--incremental', action='store_true',
+        help="пересчитать только версии, затронутые после прошлого запуска "
+             "(при изменении debtracker — полный пересчёт)"
+    )
+    return parser.parse_args()
+
+
 def main():
-    conn = psycopg2.connect(**DB_CONFIG)
+    args = parse_args()
+    conn = psycopg2.connect(**DB_CONFIG, cursor_factory=metrics.cursor_factory())
     conn.autocommit = False
     cur = conn.cursor()
 
     try:
+        scope = FULL_SCOPE
+        state = None  # состояние для сохранения в режиме --incremental
+        if args.incremental:
+            with metrics.stage('incremental_scope') as stage:
+                setup_incremental_state(conn)
+                state = read_current_state(cur)
+                saved = load_saved_state(cur)
+                if saved is None:
+                    # fixed_cve_hits заполнит основной поиск: changelog просматривается один раз
+                    print("Сохранённого состояния нет, выполняется полный пересчёт.")
+                else:
+                    hits = update_cve_hits(cur, saved, state)
+                    print(f"Новых упоминаний CVE в changelog: {hits}.")
+                    if saved['debtracker_state'] != state['debtracker_state']:
+                        print("Данные debtracker изменились, выполняется полный пересчёт.")
+                    else:
+                        scope = INCREMENTAL_SCOPE
+                        stage['rows'] = prepare_incremental_scope(cur, saved, state)
+                        print(f"Инкрементальный режим: версий для пересчёта {stage['rows']}.")
+            if scope == INCREMENTAL_SCOPE and stage['rows'] == 0:
+                save_incremental_state(cur, state, scope)
+                conn.commit()
+                print("Нет изменений с прошлого запуска.")
+                return
+
+        if args.pushdown:
+            with metrics.stage('pushdown_upsert') as stage:
+                stage['rows'] = fill_fixed_cve_pushdown(cur, scope, store_hits=state is not None)
+                if state is not None:
+                    save_incremental_state(cur, state, scope)
+                conn.commit()
+            print(f"Выполнена вставка/обновление {stage['rows']} записей в fixed_cve_status (pushdown).")
+            return
+
         print("Загрузка справочных данных...")
 
-        # 1. Загружаем список версий пакетов из таблицы assm_pkg_vrs (поле pkg_vrs_id) в схеме repositories.
-        cur.execute("SELECT pkg_vrs_id FROM repositories.assm_pkg_vrs;")
-        pkg_vrs_ids = [row[0] for row in cur.fetchall()]
-        pkg_vrs_set = set(pkg_vrs_ids)
-
-        # 2. Загружаем справочник уязвимостей: сопоставление CVE (поле name) -> id (из repositories.vulnerabilities)
-        cur.execute("SELECT id, name FROM repositories.vulnerabilities;")
-        vuln_rows = cur.fetchall()
-        vuln_map = {row[1]: row[0] for row in vuln_rows}  # например: 'CVE-2007-6353' -> vulnerability_id
-
-        # 3. Загружаем данные по версиям пакетов из repositories.pkg_version
-        #    Здесь получаем pkg_vrs_id, version и pkg_id для сопоставления с пакетами.
-        cur.execute("SELECT pkg_vrs_id, version, pkg_id FROM repositories.pkg_version;")
-        pkg_version_rows = cur.fetchall()
-        pkg_version_map = {row[0]: {'version': row[1], 'pkg_id': row[2]} for row in pkg_version_rows}
-
-        # 4. Загружаем данные по пакетам из repositories.package: pkg_id -> pkg_name.
-        cur.execute("SELECT pkg_id, pkg_name FROM repositories.package;")
-        package_rows = cur.fetchall()
-        package_map = {row[0]: row[1] for row in package_rows}
-
-        # 5. Для репозитория строим mapping: (version, pkg_name) -> pkg_vrs_id, только для версий из assm_pkg_vrs.
-        repo_ver_pkg_map = {}
-        for pkg_vrs in pkg_vrs_set:
-            details = pkg_version_map.get(pkg_vrs)
-            if details:
-                version = details['version']
-                pkg_id = details['pkg_id']
-                pkg_name = package_map.get(pkg_id)
-                if pkg_name:
-                    repo_ver_pkg_map[(version, pkg_name)] = pkg_vrs
-
-        # 6. Загружаем записи из changelog (repositories.changelog)
-        #    Фильтруем только те, у которых pkg_vrs_id входит в список assm_pkg_vrs.
-        cur.execute(
-            "SELECT id, pkg_vrs_id, log_desc FROM repositories.changelog WHERE pkg_vrs_id = ANY(%s);",
-            (list(pkg_vrs_set),)
-        )
-        changelog_rows = cur.fetchall()
-        changelog_list = [{'id': row[0], 'pkg_vrs_id': row[1], 'log_desc': row[2]} for row in changelog_rows]
-        print(f"Найдено {len(changelog_list)} записей в changelog для выбранных версий.")
-
-        # 7. Формируем mapping для каждой версии пакета: pkg_vrs_id -> минимальный (ранний) id записи из changelog.
-        #    Это значение позже используется для fixed_tracker_string_number.
-        changelog_pk_map = {}
-        for row in changelog_list:
-            pkg_vrs = row['pkg_vrs_id']
-            if pkg_vrs not in changelog_pk_map or row['id'] < changelog_pk_map[pkg_vrs]:
-                changelog_pk_map[pkg_vrs] = row['id']
-
-        # 8. Обрабатываем записи changelog для поиска вхождений CVE.
-        #    Для каждой уникальной пары (pkg_vrs_id, CVE) (учитывая vulnerability_id) будет создана запись.
-        upsert_data = {}  # ключ: (pkg_vrs_id, vulnerability_id), значение: словарь с данными для вставки
-        for entry in changelog_list:
-            pkg_vrs = entry['pkg_vrs_id']
-            log_desc = entry['log_desc']
-            matches = CVE_PATTERN.findall(log_desc)
-            if not matches:
-                continue
-            for cve in set(matches):
-                vulnerability_id = vuln_map.get(cve)
+        with metrics.stage('load_reference_data') as stage:
+            # 1. Загружаем список версий пакетов из таблицы assm_pkg_vrs (поле pkg_vrs_id) в схеме repositories
+            #    (в режиме --incremental — только затронутые версии).
+            cur.execute(f"SELECT pkg_vrs_id FROM {scope};")
+            pkg_vrs_ids = [row[0] for row in cur.fetchall()]
+            pkg_vrs_set = set(pkg_vrs_ids)
+
+            # 2. Загружаем справочник уязвимостей: сопоставление CVE (поле name) -> id (из repositories.vulnerabilities)
+            #    ORDER BY id: при повторяющихся именах остаётся наибольший id (так же, как в режиме --pushdown)
+            cur.execute("SELECT id, name FROM repositories.vulnerabilities ORDER BY id;")
+            vuln_rows = cur.fetchall()
+            vuln_map = {row[1]: row[0] for row in vuln_rows}  # например: 'CVE-2007-6353' -> vulnerability_id
+
+            # 3. Загружаем данные по версиям пакетов из repositories.pkg_version
+            #    Здесь получаем pkg_vrs_id, version и pkg_id для сопоставления с пакетами (только версии scope).
+            cur.execute(f"""
+                SELECT pv.pkg_vrs_id, pv.version, pv.pkg_id
+                FROM repositories.pkg_version pv
+                WHERE EXISTS (SELECT 1 FROM {scope} s WHERE s.pkg_vrs_id = pv.pkg_vrs_id);
+            """)
+            pkg_version_rows = cur.fetchall()
+            pkg_version_map = {row[0]: {'version': row[1], 'pkg_id': row[2]} for row in pkg_version_rows}
+
+            # 4. Загружаем данные по пакетам из repositories.package: pkg_id -> pkg_name.
+            cur.execute("SELECT pkg_id, pkg_name FROM repositories.package;")
+            package_rows = cur.fetchall()
+            package_map = {row[0]: row[1] for row in package_rows}
+
+            # 5. Для репозитория строим mapping: (version, pkg_name) -> pkg_vrs_id, только для версий из assm_pkg_vrs.
+            repo_ver_pkg_map = {}
+            for pkg_vrs in pkg_vrs_set:
+                details = pkg_version_map.get(pkg_vrs)
+                if details:
+                    version = details['version']
+                    pkg_id = details['pkg_id']
+                    pkg_name = package_map.get(pkg_id)
+                    if pkg_name:
+                        repo_ver_pkg_map[(version, pkg_name)] = pkg_vrs
+            stage['rows'] = len(pkg_vrs_ids) + len(vuln_rows) + len(pkg_version_rows) + len(package_rows)
+
+        with metrics.stage('scan_changelog') as stage:
+            # 6-8. Потоково читаем changelog (только версии из assm_pkg_vrs) и сразу ищем в порции
+            #      вхождения CVE. Для каждой уникальной пары (pkg_vrs_id, vulnerability_id)
+            #      будет создана запись.
+            changelog_pk_map = {}  # pkg_vrs_id -> минимальный id записи changelog
+            upsert_data = {}  # ключ: (pkg_vrs_id, vulnerability_id), значение: словарь с данными для вставки
+            # В режиме --incremental найденные упоминания сохраняются в fixed_cve_hits по ходу поиска
+            on_hits = (lambda hits: store_cve_hits(cur, hits)) if state is not None else None
+            stage['rows'] = scan_changelog(iter_changelog_chunks(conn, scope), vuln_map, upsert_data, changelog_pk_map,
+                                           workers=args.workers, on_hits=on_hits)
+            print(f"Найдено {stage['rows']} записей в changelog для выбранных версий.")
+
+        with metrics.stage('debtracker') as stage:
+            # 9. Обрабатываем данные из debtracker, с дополнительным сравнением по version и pkg_name.
+            #    Из debtracker извлекаем: cve_name, fixed_pkg_vrs_id, version и pkg_name.
+            cur.execute("""
+                SELECT dc.cve_name, cr.fixed_pkg_vrs_id, pv.version, p.pkg_name
+                FROM debtracker.cve dc
+                JOIN debtracker.cve_rep cr ON dc.cve_id = cr.cve_id
+                JOIN debtracker.pkg_version pv ON pv.pkg_vrs_id = cr.fixed_pkg_vrs_id
+                JOIN debtracker.package p ON p.pkg_id = pv.pkg_id;
+            """)
+            debtracker_rows = cur.fetchall()
+            for row in debtracker_rows:
+                deb_cve_name = row[0]
+                # debtracker_fixed_pkg_vrs_id = row[1]  --> не используем напрямую, так как id не совпадают
+                deb_version = row[2]
+                deb_pkg_name = row[3]
+                # Находим в mapping репозитория соответствующую версию и пакет по (version, pkg_name)
+                repo_pkg_vrs_id = repo_ver_pkg_map.get((deb_version, deb_pkg_name))
+                if repo_pkg_vrs_id is None:
+                    # Если в репозитории не найдено соответствующей версии по данным debtracker, пропускаем
+                    continue
+                vulnerability_id = vuln_map.get(deb_cve_name)
                 if vulnerability_id is None:
-                    print(f"Предупреждение: {cve} не найден в vulnerabilities (changelog id: {entry['id']}).")
+                    print(f"Предупреждение: {deb_cve_name} из debtracker не найден в vulnerabilities.")
                     continue
-                key = (pkg_vrs, vulnerability_id)
-                if key not in upsert_data:
-                    upsert_data[key] = {
-                        'changelog_string_number': entry['id'],
-                        'fixed_tracker_string_number': None
-                    }
-        # 9. Обрабатываем данные из debtracker, с дополнительным сравнением по version и pkg_name.
-        #    Из debtracker извлекаем: cve_name, fixed_pkg_vrs_id, version и pkg_name.
-        cur.execute("""
-            SELECT dc.cve_name, cr.fixed_pkg_vrs_id, pv.version, p.pkg_name
-            FROM debtracker.cve dc
-            JOIN debtracker.cve_rep cr ON dc.cve_id = cr.cve_id
-            JOIN debtracker.pkg_version pv ON pv.pkg_vrs_id = cr.fixed_pkg_vrs_id
-            JOIN debtracker.package p ON p.pkg_id = pv.pkg_id;
-        """)
-        debtracker_rows = cur.fetchall()
-        for row in debtracker_rows:
-            deb_cve_name = row[0]
-            # debtracker_fixed_pkg_vrs_id = row[1]  --> не используем напрямую, так как id не совпадают
-            deb_version = row[2]
-            deb_pkg_name = row[3]
-            # Находим в mapping репозитория соответствующую версию и пакет по (version, pkg_name)
-            repo_pkg_vrs_id = repo_ver_pkg_map.get((deb_version, deb_pkg_name))
-            if repo_pkg_vrs_id is None:
-                # Если в репозитории не найдено соответствующей версии по данным debtracker, пропускаем
-                continue
-            vulnerability_id = vuln_map.get(deb_cve_name)
-            if vulnerability_id is None:
-                print(f"Предупреждение: {deb_cve_name} из debtracker не найден в vulnerabilities.")
-                continue
-            key = (repo_pkg_vrs_id, vulnerability_id)
-            # Если запись уже есть — обновляем fixed_tracker_string_number, если его ещё нет.
-            current = upsert_data.get(key, {'changelog_string_number': None, 'fixed_tracker_string_number': None})
-            if current['fixed_tracker_string_number'] is None:
-                # Берём значение из mapping для данной версии из changelog
-                current['fixed_tracker_string_number'] = changelog_pk_map.get(repo_pkg_vrs_id)
-            upsert_data[key] = current
+                key = (repo_pkg_vrs_id, vulnerability_id)
+                # Если запись уже есть — обновляем fixed_tracker_string_number, если его ещё нет.
+                current = upsert_data.get(key, {'changelog_string_number': None, 'fixed_tracker_string_number': None})
+                if current['fixed_tracker_string_number'] is None:
+                    # Берём значение из mapping для данной версии из changelog
+                    current['fixed_tracker_string_number'] = changelog_pk_map.get(repo_pkg_vrs_id)
+                upsert_data[key] = current
+            stage['rows'] = len(debtracker_rows)
 
         # 10. Подготавливаем список записей для bulk-вставки / upsert.
         records = []
@@ -146,12 +563,16 @@ def main():
                 changelog_string_number = COALESCE(repositories.fixed_cve_status.changelog_string_number, EXCLUDED.changelog_string_number),
                 fixed_tracker_string_number = COALESCE(repositories.fixed_cve_status.fixed_tracker_string_number, EXCLUDED.fixed_tracker_string_number)
         """
-        if records:
-            execute_values(cur, upsert_query, records, page_size=100)
+        with metrics.stage('upsert') as stage:
+            if records:
+                execute_values(cur, upsert_query, records, page_size=100)
+                print(f"Выполнена вставка/обновление {len(records)} записей в fixed_cve_status.")
+            else:
+                print("Нет данных для вставки в fixed_cve_status.")
+            if state is not None:
+                save_incremental_state(cur, state, scope)
             conn.commit()
-            print(f"Выполнена вставка/обновление {len(records)} записей в fixed_cve_status.")
-        else:
-            print("Нет данных для вставки в fixed_cve_status.")
+            stage['rows'] = len(records)
 
     except Exception as e:
         conn.rollback()
@@ -159,6 +580,7 @@ def main():
     finally:
         cur.close()
         conn.close()
+        metrics.write_summary(METRICS_PATH)
 
 if __name__ == '__main__':
     main()
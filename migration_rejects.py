@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Таблица карантина migration_rejects, общая для main.py и final_script.py.
+
+Запись помечается источником (producer). final_script.py сохраняет в payload строку
+staging целиком (to_jsonb), и restage_rejects возвращает такие записи в staging.
+main.py сохраняет данные вставки или строку выборки SQLite; эти записи только хранятся
+для разбора и в staging не возвращаются.
+"""
+
+PRODUCER_STAGING = 'final_script'
+PRODUCER_MAIN = 'main'
+
+# DDL таблицы карантина; выполняется обоими скриптами, поэтому все операторы идемпотентны.
+# retrying отмечает записи, возвращённые в staging текущим запуском final_script.py
+REJECTS_DDL = [
+    f"""
+    CREATE TABLE IF NOT EXISTS migration_rejects (
+        id BIGSERIAL PRIMARY KEY,
+        source_table TEXT NOT NULL,
+        old_id INTEGER,
+        reason TEXT NOT NULL,
+        payload JSONB NOT NULL,
+        rejected_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+        retrying BOOLEAN NOT NULL DEFAULT FALSE,
+        producer TEXT NOT NULL DEFAULT '{PRODUCER_STAGING}'
+    )
+    """,
+    """
+    ALTER TABLE migration_rejects
+    ADD COLUMN IF NOT EXISTS retrying BOOLEAN NOT NULL DEFAULT FALSE
+    """,
+    f"""
+    ALTER TABLE migration_rejects
+    ADD COLUMN IF NOT EXISTS producer TEXT NOT NULL DEFAULT '{PRODUCER_STAGING}'
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_migration_rejects_source
+    ON migration_rejects (source_table, reason)
+    """,
+]
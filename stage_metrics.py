@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Замеры этапов миграции: время, количество строк, строк в секунду, объём данных,
+отправленных в PostgreSQL, число обращений к серверу и пиковый RSS.
+В конце запуска сводка по этапам записывается в JSON.
+"""
+
+import json
+import logging
+import resource
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+def peak_rss_mb():
+    """
+    Пиковый RSS процесса и его завершившихся дочерних процессов (воркеров пула), МБ.
+    """
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return round(max(own, children) / 1024, 1)
+
+
+def encoded_len(data):
+    """
+    Размер данных в байтах: строки считаются в кодировке UTF-8 (кодировка клиента),
+    а не по числу символов.
+    """
+    if isinstance(data, str):
+        return len(data.encode('utf-8'))
+    return len(data)
+
+
+class CountingReader:
+    """
+    Обёртка файлоподобного источника COPY: считает переданные байты.
+    """
+    def __init__(self, source, metrics):
+        self._source = source
+        self._metrics = metrics
+
+    def read(self, size=-1):
+        data = self._source.read(size)
+        self._metrics.bytes_sent += encoded_len(data)
+        return data
+
+    def readline(self, size=-1):
+        data = self._source.readline(size)
+        self._metrics.bytes_sent += encoded_len(data)
+        return data
+
+
+class StageMetrics:
+    """
+    Накопитель метрик одного запуска. Этапы с одинаковым именем (например,
+    update_id_mappings после каждого шага) суммируются в одну запись.
+    Трафик считается курсором из cursor_factory (psycopg2) или слушателем
+    attach_engine (SQLAlchemy).
+    """
+    def __init__(self, run_name):
+        self.run_name = run_name
+        self.bytes_sent = 0
+        self.round_trips = 0
+        self.stages = {}
+        self._started = time.perf_counter()
+
+    def count_statement(self, statement):
+        """
+        Учитывает один запрос к серверу: текст запроса после подстановки параметров.
+        """
+        self.round_trips += 1
+        if statement:
+            self.bytes_sent += encoded_len(statement)
+
+    def add_traffic(self, bytes_sent, round_trips):
+        """
+        Добавляет трафик, посчитанный в другом процессе (воркеры параллельной загрузки).
+        """
+        self.bytes_sent += bytes_sent
+        self.round_trips += round_trips
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Замеряет этап. Количество обработанных строк записывается в stage['rows'].
+        Этап, завершившийся исключением, учитывается в errors.
+        """
+        stage = {'rows': 0}
+        bytes_before, trips_before = self.bytes_sent, self.round_trips
+        started = time.perf_counter()
+        failed = False
+        try:
+            yield stage
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            record = self.stages.setdefault(name, {
+                'calls': 0, 'errors': 0, 'wall_time': 0.0, 'rows': 0, 'bytes_sent': 0, 'round_trips': 0,
+            })
+            record['calls'] += 1
+            record['errors'] += failed
+            record['wall_time'] += elapsed
+            record['rows'] += stage['rows']
+            record['bytes_sent'] += self.bytes_sent - bytes_before
+            record['round_trips'] += self.round_trips - trips_before
+            record['peak_rss_mb'] = peak_rss_mb()
+            logger.info(
+                f"Этап {name}: {elapsed:.2f} с, строк {stage['rows']}, "
+                f"отправлено {self.bytes_sent - bytes_before} байт за {self.round_trips - trips_before} запросов, "
+                f"пиковый RSS {record['peak_rss_mb']} МБ"
+            )
+
+    def summary(self):
+        """
+        Сводка запуска: общие показатели и показатели по этапам с rows_per_sec.
+        """
+        stages = []
+        for name, record in self.stages.items():
+            wall_time = record['wall_time']
+            stages.append(dict(
+                record,
+                stage=name,
+                wall_time=round(wall_time, 3),
+                rows_per_sec=round(record['rows'] / wall_time, 1) if wall_time else None,
+            ))
+        return {
+            'run': self.run_name,
+            'wall_time': round(time.perf_counter() - self._started, 3),
+            'bytes_sent': self.bytes_sent,
+            'round_trips': self.round_trips,
+            'peak_rss_mb': peak_rss_mb(),
+            'stages': stages,
+        }
+
+    def write_summary(self, path):
+        """
+        Записывает JSON-сводку в файл и дублирует её в лог.
+        """
+        summary = self.summary()
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+        logger.info(f"Сводка этапов ({path}): {json.dumps(summary, ensure_ascii=False)}")
+        return summary
+
+    def cursor_factory(self):
+        """
+        Класс курсора psycopg2, учитывающий запросы и данные COPY этого накопителя.
+        Передаётся в psycopg2.connect(..., cursor_factory=...).
+        """
+        import psycopg2.extensions
+
+        metrics = self
+
+        class CountingCursor(psycopg2.extensions.cursor):
+            def execute(self, query, vars=None):
+                try:
+                    return super().execute(query, vars)
+                finally:
+                    metrics.count_statement(self.query)
+
+            def executemany(self, query, vars_list):
+                vars_list = list(vars_list)
+                try:
+                    return super().executemany(query, vars_list)
+                finally:
+                    metrics.round_trips += max(len(vars_list) - 1, 0)
+                    metrics.count_statement(self.query)
+
+            def fetchmany(self, size=None):
+                # У именованного (серверного) курсора каждый fetchmany — отдельный FETCH
+                if self.name:
+                    metrics.round_trips += 1
+                return super().fetchmany(size) if size is not None else super().fetchmany()
+
+            def copy_expert(self, sql, file, size=8192):
+                metrics.count_statement(sql)
+                return super().copy_expert(sql, CountingReader(file, metrics), size)
+
+        return CountingCursor
+
+    def attach_engine(self, engine):
+        """
+        Подключает учёт запросов к Engine SQLAlchemy (слушатель after_cursor_execute).
+        """
+        from sqlalchemy import event
+
+        def count_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            self.count_statement(getattr(cursor, 'query', None) or statement)
+
+        event.listen(engine, 'after_cursor_execute', count_cursor_execute)
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Общая часть загрузки staging для temp.py и final_script.py: источники staging
+в SQLite и потоковая загрузка строк через COPY FROM STDIN или пакетные INSERT.
+"""
+
+from itertools import chain
+
+# Сколько символов отдавать в COPY за одно чтение
+COPY_BUFFER_SIZE = 1024 * 1024
+COPY_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+# Сколько строк читать из SQLite за один fetchmany
+SQLITE_FETCH_SIZE = 10000
+
+# Источники staging: таблица staging -> запрос к SQLite, столбцы приёмника
+# и выражение rowid исходной таблицы (для деления на диапазоны)
+STAGING_SOURCES = {
+    'publishers': {
+        'query': "SELECT id, name FROM publishers",
+        'columns': ('old_id', 'name'),
+        'rowid': 'rowid',
+    },
+    'projects': {
+        'query': """
+            SELECT p.id, p.name, p.rls_ref, p.description, pub.name, p.arc_ref
+            FROM projects p
+            JOIN publishers pub ON p.pbr_ref = pub.id
+        """,
+        'columns': ('old_id', 'name', 'rls_ref', 'description', 'vendor', 'arc_ref'),
+        'rowid': 'p.rowid',
+    },
+    'assemblies': {
+        'query': "SELECT id, time, description, prj_ref, pbr_ref FROM assemblies",
+        'columns': ('old_id', 'time', 'description', 'prj_ref', 'pbr_ref'),
+        'rowid': 'rowid',
+    },
+    'src_packages': {
+        'query': "SELECT id, name FROM src_packages",
+        'columns': ('old_id', 'name'),
+        'rowid': 'rowid',
+    },
+    'pkg_versions': {
+        'query': "SELECT id, time, maintainer, src_pkg_ref, version FROM pkg_versions",
+        'columns': ('old_id', 'time', 'maintainer', 'src_pkg_ref', 'version'),
+        'rowid': 'rowid',
+    },
+    'asm_pkg_vsn_lnk': {
+        'query': "SELECT asm_ref, pkg_vsn_ref FROM asm_pkg_vsn_lnk",
+        'columns': ('asm_ref', 'pkg_vsn_ref'),
+        'rowid': 'rowid',
+    },
+    'changes': {
+        'query': "SELECT id, pkg_vsn_ref, special FROM changes",
+        'columns': ('old_id', 'pkg_vsn_ref', 'special'),
+        'rowid': 'rowid',
+    },
+    'urgency': {
+        'query': "SELECT id, name FROM urgency",
+        'columns': ('old_id', 'name'),
+        'rowid': 'rowid',
+    },
+    'vulnerabilities': {
+        'query': "SELECT id, name FROM vulnerabilities",
+        'columns': ('old_id', 'name'),
+        'rowid': 'rowid',
+    },
+    'chg_vln_lnk': {
+        'query': "SELECT chg_ref, vln_ref FROM chg_vln_lnk",
+        'columns': ('chg_ref', 'vln_ref'),
+        'rowid': 'rowid',
+    },
+}
+
+
+def copy_format_value(value):
+    """
+    Приводит значение к текстовому формату COPY: NULL -> \\N,
+    экранируются обратная косая черта, табуляции и переводы строк.
+    """
+    if value is None:
+        return '\\N'
+    if isinstance(value, bytes):
+        value = value.decode('utf-8', errors='replace')
+    return str(value).translate(COPY_ESCAPES)
+
+
+class CopyRowStream:
+    """
+    Файлоподобный объект для cursor.copy_expert: форматирует строки из итератора
+    по мере чтения, поэтому в памяти находится не больше одного буфера.
+    """
+    def __init__(self, rows):
+        self._rows = iter(rows)
+        self.row_count = 0
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = COPY_BUFFER_SIZE
+        parts = []
+        length = 0
+        for row in self._rows:
+            line = '\t'.join(copy_format_value(value) for value in row) + '\n'
+            parts.append(line)
+            length += len(line)
+            self.row_count += 1
+            if length >= size:
+                break
+        return ''.join(parts)
+
+
+def copy_to_table(pg_cur, table, columns, rows):
+    """
+    Потоково загружает строки в таблицу через COPY FROM STDIN.
+    Возвращает количество переданных строк.
+    """
+    stream = CopyRowStream(rows)
+    pg_cur.copy_expert(
+        f"COPY {table} ({', '.join(columns)}) FROM STDIN",
+        stream,
+        size=COPY_BUFFER_SIZE
+    )
+    return stream.row_count
+
+
+def copy_to_staging(pg_cur, table, columns, rows):
+    """
+    Потоково загружает строки в staging.<table> через COPY FROM STDIN.
+    Возвращает количество переданных строк.
+    """
+    return copy_to_table(pg_cur, f"staging.{table}", columns, rows)
+
+
+def iter_sqlite_chunks(sql_cur, chunk_size=SQLITE_FETCH_SIZE):
+    """
+    Генератор порций строк из курсора SQLite (fetchmany), чтобы в памяти
+    одновременно находилась только одна порция таблицы.
+    """
+    while True:
+        chunk = sql_cur.fetchmany(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+
+def insert_to_staging(pg_cur, table, columns, chunks):
+    """
+    Загружает порции строк в staging.<table> пакетными INSERT (execute_batch).
+    Возвращает количество переданных строк.
+    """
+    from psycopg2.extras import execute_batch
+
+    query = (f"INSERT INTO staging.{table} ({', '.join(columns)}) "
+             f"VALUES ({', '.join(['%s'] * len(columns))})")
+    count = 0
+    for chunk in chunks:
+        execute_batch(pg_cur, query, chunk)
+        count += len(chunk)
+    return count
+
+
+def load_staging_rows(pg_cur, table, chunks, mode='copy'):
+    """
+    Загружает порции строк источника STAGING_SOURCES[table] в staging.<table>:
+    mode 'copy' — потоковый COPY FROM STDIN, 'insert' — execute_batch.
+    Возвращает количество переданных строк.
+    """
+    columns = STAGING_SOURCES[table]['columns']
+    if mode == 'copy':
+        return copy_to_staging(pg_cur, table, columns, chain.from_iterable(chunks))
+    return insert_to_staging(pg_cur, table, columns, chunks)
@@ -1,30 +1,38 @@
 import sqlite3
 import psycopg2
 from datetime import datetime, timezone
-from psycopg2.extras import execute_batch, execute_values
+from psycopg2.extras import execute_values
 import logging
+import os
 import sys
 
+from bulk_logging import setup_logging
+from stage_metrics import StageMetrics
+from staging_load import SQLITE_FETCH_SIZE, STAGING_SOURCES, iter_sqlite_chunks, load_staging_rows
+
 # Конфигурация
-SQLITE_DB = '/home/ivandor/Загрузки/uroboros.db.250211'
+# Переменные окружения MIGRATION_* переопределяют значения по умолчанию (см. benchmarks/)
+SQLITE_DB = os.environ.get('MIGRATION_SQLITE_DB', '/home/ivandor/Загрузки/uroboros.db.250211')
 POSTGRES_CONFIG = {
-    'dbname': 'uroboros',
-    'user': 'owner',
-    'password': '1111',
-    'host': 'localhost',
-    'port': '5432'
+    'dbname': os.environ.get('MIGRATION_PG_DBNAME', 'uroboros'),
+    'user': os.environ.get('MIGRATION_PG_USER', 'owner'),
+    'password': os.environ.get('MIGRATION_PG_PASSWORD', '1111'),
+    'host': os.environ.get('MIGRATION_PG_HOST', 'localhost'),
+    'port': os.environ.get('MIGRATION_PG_PORT', '5432')
 }
 
+# Режим загрузки staging: 'copy' — потоковый COPY FROM STDIN, 'insert' — execute_batch
+# (источники staging и загрузка — staging_load.py)
+STAGING_LOAD_MODE = 'copy'
+# JSON-сводка по этапам (время, строки, трафик, пиковый RSS)
+METRICS_PATH = 'migration_full_metrics.json'
+
 # Настройка логирования
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(levelname)s - [%(module)s:%(lineno)d] - %(message)s',
-    handlers=[
-        logging.FileHandler("migration_full.log"),
-        logging.StreamHandler(sys.stdout)
-    ]
-)
+# Запись в файл и консоль идёт через фоновую очередь (bulk_logging.py)
+setup_logging("migration_full.log", sys.stdout,
+              '%(asctime)s - %(levelname)s - [%(module)s:%(lineno)d] - %(message)s')
 logger = logging.getLogger(__name__)
+metrics = StageMetrics('temp')
 
 
 class IdMapper:
@@ -38,7 +46,8 @@ class IdMapper:
 
     def add_mapping(self, table, old_id, new_id):
         self.mappings[table][old_id] = new_id
-        logger.debug(f"Добавлен маппинг: {table}[{old_id}] -> {new_id}")
+        # Ленивое форматирование: в массовом режиме (уровень INFO) строка не собирается
+        logger.debug("Добавлен маппинг: %s[%s] -> %s", table, old_id, new_id)
 
     def get_new_id(self, table, old_id):
         return self.mappings[table].get(old_id)
@@ -155,7 +164,7 @@ def setup_postgres_schemas(conn):
             raise
 
 
-def migrate_to_staging(sqlite_conn, pg_conn):
+def migrate_to_staging(sqlite_conn, pg_conn, chunk_size=SQLITE_FETCH_SIZE):
     """Перенос данных из SQLite во временную схему staging"""
     logger.info("Начало миграции в staging")
     id_mapper = IdMapper()
@@ -164,135 +173,17 @@ def migrate_to_staging(sqlite_conn, pg_conn):
         sql_cur = sqlite_conn.cursor()
         pg_cur = pg_conn.cursor()
 
-        # Миграция publishers
-        logger.info("Перенос publishers...")
-        sql_cur.execute("SELECT id, name FROM publishers")
-        publishers = sql_cur.fetchall()
-        if publishers:
-            execute_batch(pg_cur,
-                          "INSERT INTO staging.publishers (old_id, name) VALUES (%s, %s)",
-                          publishers)
-            logger.info(f"Перенесено publishers: {len(publishers)}")
-        else:
-            logger.warning("Таблица publishers пуста")
-
-        # Миграция projects
-        logger.info("Перенос projects...")
-        sql_cur.execute("""
-            SELECT p.id, p.name, p.rls_ref, p.description, pub.name, p.arc_ref 
-            FROM projects p
-            JOIN publishers pub ON p.pbr_ref = pub.id
-        """)
-        projects = sql_cur.fetchall()
-        if projects:
-            execute_batch(pg_cur,
-                          """INSERT INTO staging.projects 
-                             (old_id, name, rls_ref, description, vendor, arc_ref)
-                             VALUES (%s, %s, %s, %s, %s, %s)""",
-                          projects)
-            logger.info(f"Перенесено projects: {len(projects)}")
-        else:
-            logger.warning("Таблица projects пуста")
-
-        # Миграция assemblies
-        logger.info("Перенос assemblies...")
-        sql_cur.execute("SELECT id, time, description, prj_ref, pbr_ref FROM assemblies")
-        assemblies = sql_cur.fetchall()
-        if assemblies:
-            execute_batch(pg_cur,
-                          """INSERT INTO staging.assemblies 
-                             (old_id, time, description, prj_ref, pbr_ref)
-                             VALUES (%s, %s, %s, %s, %s)""",
-                          assemblies)
-            logger.info(f"Перенесено assemblies: {len(assemblies)}")
-        else:
-            logger.warning("Таблица assemblies пуста")
-
-        # Миграция src_packages
-        logger.info("Перенос src_packages...")
-        sql_cur.execute("SELECT id, name FROM src_packages")
-        packages = sql_cur.fetchall()
-        if packages:
-            execute_batch(pg_cur,
-                          "INSERT INTO staging.src_packages (old_id, name) VALUES (%s, %s)",
-                          packages)
-            logger.info(f"Перенесено src_packages: {len(packages)}")
-        else:
-            logger.warning("Таблица src_packages пуста")
-
-        # Миграция pkg_versions
-        logger.info("Перенос pkg_versions...")
-        sql_cur.execute("SELECT id, time, maintainer, src_pkg_ref, version FROM pkg_versions")
-        versions = sql_cur.fetchall()
-        if versions:
-            execute_batch(pg_cur,
-                          """INSERT INTO staging.pkg_versions 
-                             (old_id, time, maintainer, src_pkg_ref, version)
-                             VALUES (%s, %s, %s, %s, %s)""",
-                          versions)
-            logger.info(f"Перенесено pkg_versions: {len(versions)}")
-        else:
-            logger.warning("Таблица pkg_versions пуста")
-
-        # Миграция asm_pkg_vsn_lnk
-        logger.info("Перенос asm_pkg_vsn_lnk...")
-        sql_cur.execute("SELECT asm_ref, pkg_vsn_ref FROM asm_pkg_vsn_lnk")
-        links = sql_cur.fetchall()
-        if links:
-            execute_batch(pg_cur,
-                          "INSERT INTO staging.asm_pkg_vsn_lnk (asm_ref, pkg_vsn_ref) VALUES (%s, %s)",
-                          links)
-            logger.info(f"Перенесено связей asm_pkg_vsn_lnk: {len(links)}")
-        else:
-            logger.warning("Таблица asm_pkg_vsn_lnk пуста")
-
-        # Миграция changes
-        logger.info("Перенос changes...")
-        sql_cur.execute("SELECT id, pkg_vsn_ref, special FROM changes")
-        changes = sql_cur.fetchall()
-        if changes:
-            execute_batch(pg_cur,
-                          "INSERT INTO staging.changes (old_id, pkg_vsn_ref, special) VALUES (%s, %s, %s)",
-                          changes)
-            logger.info(f"Перенесено changes: {len(changes)}")
-        else:
-            logger.warning("Таблица changes пуста")
-
-        # Миграция urgency
-        logger.info("Перенос urgency...")
-        sql_cur.execute("SELECT id, name FROM urgency")
-        urgency = sql_cur.fetchall()
-        if urgency:
-            execute_batch(pg_cur,
-                          "INSERT INTO staging.urgency (old_id, name) VALUES (%s, %s)",
-                          urgency)
-            logger.info(f"Перенесено urgency: {len(urgency)}")
-        else:
-            logger.warning("Таблица urgency пуста")
-
-        # Миграция vulnerabilities
-        logger.info("Перенос vulnerabilities...")
-        sql_cur.execute("SELECT id, name FROM vulnerabilities")
-        vulns = sql_cur.fetchall()
-        if vulns:
-            execute_batch(pg_cur,
-                          "INSERT INTO staging.vulnerabilities (old_id, name) VALUES (%s, %s)",
-                          vulns)
-            logger.info(f"Перенесено vulnerabilities: {len(vulns)}")
-        else:
-            logger.warning("Таблица vulnerabilities пуста")
-
-        # Миграция chg_vln_lnk
-        logger.info("Перенос chg_vln_lnk...")
-        sql_cur.execute("SELECT chg_ref, vln_ref FROM chg_vln_lnk")
-        chg_vln = sql_cur.fetchall()
-        if chg_vln:
-            execute_batch(pg_cur,
-                          "INSERT INTO staging.chg_vln_lnk (chg_ref, vln_ref) VALUES (%s, %s)",
-                          chg_vln)
-            logger.info(f"Перенесено связей chg_vln_lnk: {len(chg_vln)}")
-        else:
-            logger.warning("Таблица chg_vln_lnk пуста")
+        for table, source in STAGING_SOURCES.items():
+            logger.info(f"Перенос {table}...")
+            with metrics.stage(f"staging:{table}") as stage:
+                sql_cur.execute(source['query'])
+                count = load_staging_rows(pg_cur, table, iter_sqlite_chunks(sql_cur, chunk_size),
+                                          STAGING_LOAD_MODE)
+                stage['rows'] = count
+            if count:
+                logger.info(f"Перенесено {table}: {count}")
+            else:
+                logger.warning(f"Таблица {table} пуста")
 
         pg_conn.commit()
         logger.info("Миграция в staging завершена успешно")
@@ -307,7 +198,7 @@ def migrate_to_staging(sqlite_conn, pg_conn):
 def create_id_mappings(pg_conn, id_mapper):
     logger.info("Создание таблицы маппинга ID")
     try:
-        with pg_conn.cursor() as cur:
+        with metrics.stage('create_id_mappings') as stage, pg_conn.cursor() as cur:
             cur.execute("DROP TABLE IF EXISTS id_mappings")
             cur.execute("""
                 CREATE TABLE IF NOT EXISTS id_mappings (
@@ -329,6 +220,7 @@ def create_id_mappings(pg_conn, id_mapper):
 
             for table_name, mapping in tables:
                 if mapping:
+                    stage['rows'] += len(mapping)
                     data = [(table_name, old_id, new_id) for old_id, new_id in mapping.items()]
                     execute_values(
                         cur,
@@ -345,6 +237,21 @@ def create_id_mappings(pg_conn, id_mapper):
         raise
 
 
+def allocate_ids(cur, table, id_column, count):
+    """
+    Резервирует count идентификаторов из последовательности table.id_column одним
+    запросом nextval по generate_series. Строки затем вставляются с явными id,
+    и соответствие old_id -> new_id известно заранее.
+    """
+    if not count:
+        return []
+    cur.execute(
+        "SELECT nextval(pg_get_serial_sequence(%s, %s)) FROM generate_series(1, %s)",
+        (table, id_column, count)
+    )
+    return [row[0] for row in cur.fetchall()]
+
+
 def process_staging_data(pg_conn, id_mapper):
     """Обработка данных и перенос в основную схему"""
     logger.info("Начало обработки данных staging")
@@ -382,70 +289,69 @@ def process_staging_data(pg_conn, id_mapper):
             logger.warning(f"pkg_versions с несуществующими пакетами: {invalid_packages}")
 
             # Основная обработка данных
-            # Обработка projects
-            logger.info("Обработка projects...")
-            cur.execute("""
-                INSERT INTO repositories.project 
-                (prj_name, rel_id, prj_desc, vendor, arch_id)
-                SELECT 
-                    COALESCE(name, 'unknown'),
-                    NULLIF(rls_ref, 0),
-                    description,
-                    COALESCE(vendor, 'unknown'),
-                    NULLIF(arc_ref, 0)
-                FROM staging.projects
-                RETURNING prj_id
-            """)
-            new_projects = cur.fetchall()
-            new_project_ids = [row[0] for row in new_projects]
-
-            cur.execute("SELECT old_id FROM staging.projects ORDER BY old_id")
-            old_project_ids = [row[0] for row in cur.fetchall()]
-
-            for old_id, new_id in zip(old_project_ids, new_project_ids):
-                id_mapper.add_mapping('projects', old_id, new_id)
-            logger.info(f"Обработано projects: {len(new_project_ids)}")
+            with metrics.stage('process:projects') as stage:
+                # Обработка projects: id резервируются заранее, маппинг известен до вставки
+                logger.info("Обработка projects...")
+                cur.execute("SELECT old_id FROM staging.projects ORDER BY old_id")
+                old_project_ids = [row[0] for row in cur.fetchall()]
+                new_project_ids = allocate_ids(cur, 'repositories.project', 'prj_id', len(old_project_ids))
+
+                cur.execute("""
+                    INSERT INTO repositories.project 
+                    (prj_id, prj_name, rel_id, prj_desc, vendor, arch_id)
+                    SELECT 
+                        n.new_id,
+                        COALESCE(s.name, 'unknown'),
+                        NULLIF(s.rls_ref, 0),
+                        s.description,
+                        COALESCE(s.vendor, 'unknown'),
+                        NULLIF(s.arc_ref, 0)
+                    FROM unnest(%s::integer[], %s::integer[]) AS n(old_id, new_id)
+                    JOIN staging.projects s ON s.old_id = n.old_id
+                """, (old_project_ids, new_project_ids))
+
+                for old_id, new_id in zip(old_project_ids, new_project_ids):
+                    id_mapper.add_mapping('projects', old_id, new_id)
+                logger.info(f"Обработано projects: {len(new_project_ids)}")
+                stage['rows'] = len(new_project_ids)
             # Вставка маппингов в id_mappings
             create_id_mappings(pg_conn, id_mapper)
 
-            # Обработка assemblies
-            logger.info("Обработка assemblies...")
-            cur.execute("""
-                WITH 
-                assemblies_data AS (
-                    SELECT 
-                        a.old_id,
-                        COALESCE(to_timestamp(NULLIF(a.time, 0)), NOW()) AS assm_date_created,
-                        COALESCE(a.description, 'No description') AS description,
-                        m.new_id AS prj_id
+            with metrics.stage('process:assemblies') as stage:
+                # Обработка assemblies: с заранее зарезервированными assm_id вместо
+                # сопоставления по (prj_id, assm_date_created, assm_desc)
+                logger.info("Обработка assemblies...")
+                cur.execute("""
+                    SELECT a.old_id
                     FROM staging.assemblies a
                     INNER JOIN id_mappings m 
                         ON a.prj_ref = m.old_id 
                         AND m.table_name = 'projects'
-                ),
-                inserted_assemblies AS (
+                    ORDER BY a.old_id
+                """)
+                old_assembly_ids = [row[0] for row in cur.fetchall()]
+                new_assembly_ids = allocate_ids(cur, 'repositories.assembly', 'assm_id', len(old_assembly_ids))
+
+                cur.execute("""
                     INSERT INTO repositories.assembly 
-                        (assm_date_created, assm_desc, prj_id, assm_version)
+                        (assm_id, assm_date_created, assm_desc, prj_id, assm_version)
                     SELECT 
-                        assm_date_created,
-                        description,
-                        prj_id,
+                        n.new_id,
+                        COALESCE(to_timestamp(NULLIF(a.time, 0)), NOW()),
+                        COALESCE(a.description, 'No description'),
+                        m.new_id,
                         ' '
-                    FROM assemblies_data
-                    RETURNING assm_id, prj_id, assm_date_created, assm_desc
-                )
-                SELECT ia.assm_id, ad.old_id
-                FROM inserted_assemblies ia
-                JOIN assemblies_data ad 
-                    ON ia.prj_id = ad.prj_id 
-                    AND ia.assm_date_created = ad.assm_date_created 
-                    AND ia.assm_desc = ad.description
-            """)
+                    FROM unnest(%s::integer[], %s::integer[]) AS n(old_id, new_id)
+                    JOIN staging.assemblies a ON a.old_id = n.old_id
+                    INNER JOIN id_mappings m 
+                        ON a.prj_ref = m.old_id 
+                        AND m.table_name = 'projects'
+                """, (old_assembly_ids, new_assembly_ids))
 
-            assemblies_mapping = cur.fetchall()
-            for new_id, old_id in assemblies_mapping:
-                id_mapper.add_mapping('assemblies', old_id, new_id)
-            logger.info(f"Обработано assemblies: {len(assemblies_mapping)}")
+                for old_id, new_id in zip(old_assembly_ids, new_assembly_ids):
+                    id_mapper.add_mapping('assemblies', old_id, new_id)
+                logger.info(f"Обработано assemblies: {len(new_assembly_ids)}")
+                stage['rows'] = len(new_assembly_ids)
 
             # Вставка маппингов в id_mappings
             create_id_mappings(pg_conn, id_mapper)
@@ -464,131 +370,135 @@ def process_staging_data(pg_conn, id_mapper):
             logger.warning(f"Записи с time=0 или NULL: {cur.fetchall()}")
 
 
-            # Обработка src_packages
-            logger.info("Обработка src_packages...")
-            cur.execute("""
-                INSERT INTO repositories.package (pkg_name)
-                SELECT DISTINCT COALESCE(name, 'unnamed_package')
-                FROM staging.src_packages
-                WHERE name IS NOT NULL
-                RETURNING pkg_id
-            """)
-            new_packages = cur.fetchall()
-            new_package_ids = [row[0] for row in new_packages]
-
-            cur.execute("SELECT old_id FROM staging.src_packages ORDER BY old_id")
-            old_package_ids = [row[0] for row in cur.fetchall()]
-
-            for old_id, new_id in zip(old_package_ids, new_package_ids):
-                id_mapper.add_mapping('src_packages', old_id, new_id)
-            logger.info(f"Обработано src_packages: {len(new_package_ids)}")
+            with metrics.stage('process:src_packages') as stage:
+                # Обработка src_packages: по одному pkg_id на уникальное имя, все old_id
+                # с этим именем получают его
+                logger.info("Обработка src_packages...")
+                cur.execute("SELECT old_id, name FROM staging.src_packages WHERE name IS NOT NULL ORDER BY old_id")
+                package_rows = cur.fetchall()
+                package_names = list(dict.fromkeys(name for _, name in package_rows))
+                package_ids = dict(zip(package_names, allocate_ids(cur, 'repositories.package', 'pkg_id',
+                                                                   len(package_names))))
+
+                cur.execute("""
+                    INSERT INTO repositories.package (pkg_id, pkg_name)
+                    SELECT new_id, pkg_name
+                    FROM unnest(%s::integer[], %s::text[]) AS n(new_id, pkg_name)
+                """, (list(package_ids.values()), list(package_ids.keys())))
+
+                for old_id, name in package_rows:
+                    id_mapper.add_mapping('src_packages', old_id, package_ids[name])
+                logger.info(f"Обработано src_packages: {len(package_ids)}")
+                stage['rows'] = len(package_rows)
             # Вставка маппингов в id_mappings
             create_id_mappings(pg_conn, id_mapper)
 
-            # Обработка pkg_versions
-            logger.info("Обработка pkg_versions...")
-            cur.execute("""
-                WITH 
-                versions_data AS (
-                    SELECT
-                        pv.old_id,
-                        COALESCE(to_timestamp(NULLIF(pv.time, 0)), NOW()) AS pkg_date_created,
-                        NULLIF(pv.maintainer, '') AS author_name,
-                        m.new_id AS pkg_id,
-                        COALESCE(NULLIF(pv.version, ''), '0.0.0') AS version
+            with metrics.stage('process:pkg_versions') as stage:
+                # Обработка pkg_versions: pkg_vrs_id резервируются заранее вместо сопоставления
+                # по (pkg_date_created, author_name, pkg_id, version)
+                logger.info("Обработка pkg_versions...")
+                cur.execute("""
+                    SELECT pv.old_id
                     FROM staging.pkg_versions pv
                     INNER JOIN id_mappings m 
                         ON pv.src_pkg_ref = m.old_id 
                         AND m.table_name = 'src_packages'
-                ),
-                inserted_versions AS (
+                    ORDER BY pv.old_id
+                """)
+                old_version_ids = [row[0] for row in cur.fetchall()]
+                new_version_ids = allocate_ids(cur, 'repositories.pkg_version', 'pkg_vrs_id', len(old_version_ids))
+
+                cur.execute("""
                     INSERT INTO repositories.pkg_version 
-                        (pkg_date_created, author_name, pkg_id, version)
-                    SELECT 
-                        pkg_date_created,
-                        author_name,
-                        pkg_id,
-                        version
-                    FROM versions_data
-                    RETURNING pkg_vrs_id, pkg_date_created, author_name, pkg_id, version
-                )
-                SELECT iv.pkg_vrs_id, vd.old_id
-                FROM inserted_versions iv
-                JOIN versions_data vd 
-                    ON iv.pkg_date_created = vd.pkg_date_created
-                    AND iv.author_name = vd.author_name
-                    AND iv.pkg_id = vd.pkg_id
-                    AND iv.version = vd.version
-            """)
+                        (pkg_vrs_id, pkg_date_created, author_name, pkg_id, version)
+                    SELECT
+                        n.new_id,
+                        COALESCE(to_timestamp(NULLIF(pv.time, 0)), NOW()),
+                        NULLIF(pv.maintainer, ''),
+                        m.new_id,
+                        COALESCE(NULLIF(pv.version, ''), '0.0.0')
+                    FROM unnest(%s::integer[], %s::integer[]) AS n(old_id, new_id)
+                    JOIN staging.pkg_versions pv ON pv.old_id = n.old_id
+                    INNER JOIN id_mappings m 
+                        ON pv.src_pkg_ref = m.old_id 
+                        AND m.table_name = 'src_packages'
+                """, (old_version_ids, new_version_ids))
 
-            versions_mapping = cur.fetchall()
-            for new_id, old_id in versions_mapping:
-                id_mapper.add_mapping('pkg_versions', old_id, new_id)
-            logger.info(f"Обработано pkg_versions: {len(versions_mapping)}")
+                for old_id, new_id in zip(old_version_ids, new_version_ids):
+                    id_mapper.add_mapping('pkg_versions', old_id, new_id)
+                logger.info(f"Обработано pkg_versions: {len(new_version_ids)}")
+                stage['rows'] = len(new_version_ids)
             # Вставка маппингов в id_mappings
             create_id_mappings(pg_conn, id_mapper)
             logger.debug(f"Маппинг pkg_versions: {id_mapper.mappings['pkg_versions']}")
 
-            # Обработка urgency
-            logger.info("Обработка urgency...")
-            cur.execute("""
-                INSERT INTO repositories.urgency (urg_name)
-                SELECT DISTINCT COALESCE(name, 'unknown')
-                FROM staging.urgency
-                WHERE name IS NOT NULL
-                RETURNING urg_id
-            """)
-            new_urgency_ids = [row[0] for row in cur.fetchall()]
-
-            cur.execute("SELECT old_id FROM staging.urgency ORDER BY old_id")
-            old_urgency_ids = [row[0] for row in cur.fetchall()]
-
-            for old_id, new_id in zip(old_urgency_ids, new_urgency_ids):
-                id_mapper.add_mapping('urgency', old_id, new_id)
-            logger.info(f"Обработано urgency: {len(new_urgency_ids)}")
+            with metrics.stage('process:urgency') as stage:
+                # Обработка urgency: по одному id на уникальное имя, все old_id
+                # с этим именем получают его
+                logger.info("Обработка urgency...")
+                cur.execute("SELECT old_id, name FROM staging.urgency WHERE name IS NOT NULL ORDER BY old_id")
+                urgency_rows = cur.fetchall()
+                urgency_names = list(dict.fromkeys(name for _, name in urgency_rows))
+                urgency_ids = dict(zip(urgency_names, allocate_ids(cur, 'repositories.urgency', 'urg_id',
+                                                                   len(urgency_names))))
+
+                cur.execute("""
+                    INSERT INTO repositories.urgency (urg_id, urg_name)
+                    SELECT new_id, urg_name
+                    FROM unnest(%s::integer[], %s::text[]) AS n(new_id, urg_name)
+                """, (list(urgency_ids.values()), list(urgency_ids.keys())))
+
+                for old_id, name in urgency_rows:
+                    id_mapper.add_mapping('urgency', old_id, urgency_ids[name])
+                logger.info(f"Обработано urgency: {len(urgency_ids)}")
+                stage['rows'] = len(urgency_rows)
 
             # Вставка маппингов в id_mappings
             create_id_mappings(pg_conn, id_mapper)
 
-            # Обработка vulnerabilities
-            logger.info("Обработка vulnerabilities...")
-            cur.execute("""
-                INSERT INTO repositories.vulnerabilities (name)
-                SELECT DISTINCT COALESCE(name, 'unnamed_vulnerability')
-                FROM staging.vulnerabilities
-                WHERE name IS NOT NULL
-                RETURNING id
-            """)
-            new_vuln_ids = [row[0] for row in cur.fetchall()]
-
-            cur.execute("SELECT old_id FROM staging.vulnerabilities ORDER BY old_id")
-            old_vuln_ids = [row[0] for row in cur.fetchall()]
-
-            for old_id, new_id in zip(old_vuln_ids, new_vuln_ids):
-                id_mapper.add_mapping('vulnerabilities', old_id, new_id)
-            logger.info(f"Обработано vulnerabilities: {len(new_vuln_ids)}")
+            with metrics.stage('process:vulnerabilities') as stage:
+                # Обработка vulnerabilities: по одному id на уникальное имя
+                logger.info("Обработка vulnerabilities...")
+                cur.execute("SELECT old_id, name FROM staging.vulnerabilities WHERE name IS NOT NULL ORDER BY old_id")
+                vuln_rows = cur.fetchall()
+                vuln_names = list(dict.fromkeys(name for _, name in vuln_rows))
+                vuln_ids = dict(zip(vuln_names, allocate_ids(cur, 'repositories.vulnerabilities', 'id',
+                                                             len(vuln_names))))
+
+                cur.execute("""
+                    INSERT INTO repositories.vulnerabilities (id, name)
+                    SELECT new_id, name
+                    FROM unnest(%s::integer[], %s::text[]) AS n(new_id, name)
+                """, (list(vuln_ids.values()), list(vuln_ids.keys())))
+
+                for old_id, name in vuln_rows:
+                    id_mapper.add_mapping('vulnerabilities', old_id, vuln_ids[name])
+                logger.info(f"Обработано vulnerabilities: {len(vuln_ids)}")
+                stage['rows'] = len(vuln_rows)
 
             # Вставка маппингов в id_mappings
             create_id_mappings(pg_conn, id_mapper)
 
-            # Обработка связей assembly-package
-            logger.info("Обработка связей assembly-package...")
-            cur.execute("""
-                INSERT INTO repositories.assm_pkg_vrs (assm_id, pkg_vrs_id)
-                SELECT 
-                    a.new_id,
-                    p.new_id
-                FROM staging.asm_pkg_vsn_lnk l
-                JOIN id_mappings a 
-                    ON l.asm_ref = a.old_id 
-                    AND a.table_name = 'assemblies'
-                JOIN id_mappings p 
-                    ON l.pkg_vsn_ref = p.old_id 
-                    AND p.table_name = 'pkg_versions'
-                WHERE a.new_id IS NOT NULL 
-                    AND p.new_id IS NOT NULL
-            """)
-            logger.info(f"Добавлено связей assembly-package: {cur.rowcount}")
+            with metrics.stage('process:assm_pkg_vrs') as stage:
+                # Обработка связей assembly-package
+                logger.info("Обработка связей assembly-package...")
+                cur.execute("""
+                    INSERT INTO repositories.assm_pkg_vrs (assm_id, pkg_vrs_id)
+                    SELECT 
+                        a.new_id,
+                        p.new_id
+                    FROM staging.asm_pkg_vsn_lnk l
+                    JOIN id_mappings a 
+                        ON l.asm_ref = a.old_id 
+                        AND a.table_name = 'assemblies'
+                    JOIN id_mappings p 
+                        ON l.pkg_vsn_ref = p.old_id 
+                        AND p.table_name = 'pkg_versions'
+                    WHERE a.new_id IS NOT NULL 
+                        AND p.new_id IS NOT NULL
+                """)
+                logger.info(f"Добавлено связей assembly-package: {cur.rowcount}")
+                stage['rows'] = cur.rowcount
             # Вставка маппингов в id_mappings
             create_id_mappings(pg_conn, id_mapper)
 
@@ -640,40 +550,53 @@ def process_staging_data(pg_conn, id_mapper):
                 for link in bad_links:
                     logger.error(f"  {link[0]} | {link[1]} | {link[2]} | {link[3]}")
 
-            # Обработка changelog
-            logger.info("Обработка changelog...")
-            cur.execute("""
-                WITH changelog_data AS (
-                    SELECT
-                        c.old_id,
-                        COALESCE(c.special, '') AS log_desc,
-                        p.new_id AS pkg_vrs_id,
-                        COALESCE(to_timestamp(pv.time), NOW()) AS date_added,
-                        COALESCE(STRING_AGG(v.name, ', '), '') AS log_ident
-                    FROM staging.changes c
-                    INNER JOIN id_mappings p 
-                        ON c.pkg_vsn_ref = p.old_id 
-                        AND p.table_name = 'pkg_versions'
-                    LEFT JOIN staging.chg_vln_lnk lnk 
-                        ON c.old_id = lnk.chg_ref
-                    LEFT JOIN staging.vulnerabilities v 
-                        ON lnk.vln_ref = v.old_id
-                    JOIN staging.pkg_versions pv 
-                        ON c.pkg_vsn_ref = pv.old_id
-                    GROUP BY c.old_id, c.special, p.new_id, pv.time
-                )
-                INSERT INTO repositories.changelog 
-                (log_desc, pkg_vrs_id, date_added, log_ident)
-                SELECT 
-                    log_desc,
-                    pkg_vrs_id,
-                    date_added,
-                    log_ident
-                FROM changelog_data
-                WHERE log_desc IS NOT NULL
-            """)
-            inserted_changes = cur.rowcount
-            logger.info(f"Добавлено записей changelog: {inserted_changes}")
+            with metrics.stage('process:changes') as stage:
+                # Обработка changelog: id выдаются через nextval до вставки,
+                # чтобы сохранить точное соответствие changes.old_id -> changelog.id
+                logger.info("Обработка changelog...")
+                cur.execute("""
+                    WITH changelog_data AS (
+                        SELECT
+                            c.old_id,
+                            nextval(pg_get_serial_sequence('repositories.changelog', 'id')) AS new_id,
+                            COALESCE(c.special, '') AS log_desc,
+                            p.new_id AS pkg_vrs_id,
+                            COALESCE(to_timestamp(pv.time), NOW()) AS date_added,
+                            COALESCE(STRING_AGG(v.name, ', '), '') AS log_ident
+                        FROM staging.changes c
+                        INNER JOIN id_mappings p 
+                            ON c.pkg_vsn_ref = p.old_id 
+                            AND p.table_name = 'pkg_versions'
+                        LEFT JOIN staging.chg_vln_lnk lnk 
+                            ON c.old_id = lnk.chg_ref
+                        LEFT JOIN staging.vulnerabilities v 
+                            ON lnk.vln_ref = v.old_id
+                        JOIN staging.pkg_versions pv 
+                            ON c.pkg_vsn_ref = pv.old_id
+                        GROUP BY c.old_id, c.special, p.new_id, pv.time
+                    ),
+                    inserted_changes AS (
+                        INSERT INTO repositories.changelog 
+                        (id, log_desc, pkg_vrs_id, date_added, log_ident)
+                        SELECT 
+                            new_id,
+                            log_desc,
+                            pkg_vrs_id,
+                            date_added,
+                            log_ident
+                        FROM changelog_data
+                        WHERE log_desc IS NOT NULL
+                        RETURNING id
+                    )
+                    SELECT cd.old_id, cd.new_id
+                    FROM changelog_data cd
+                    JOIN inserted_changes ic ON ic.id = cd.new_id
+                """)
+                changes_mapping = cur.fetchall()
+                for old_id, new_id in changes_mapping:
+                    id_mapper.add_mapping('changes', old_id, new_id)
+                logger.info(f"Добавлено записей changelog: {len(changes_mapping)}")
+                stage['rows'] = len(changes_mapping)
             # Вставка маппингов в id_mappings
             create_id_mappings(pg_conn, id_mapper)
 
@@ -697,7 +620,7 @@ def main():
 
         # Подключение к PostgreSQL
         logger.info("Подключение к PostgreSQL")
-        pg_conn = psycopg2.connect(**POSTGRES_CONFIG)
+        pg_conn = psycopg2.connect(**POSTGRES_CONFIG, cursor_factory=metrics.cursor_factory())
         pg_conn.autocommit = False
 
         # Инициализация временной схемы
@@ -712,7 +635,7 @@ def main():
         logger.info("Этап 2: Создание таблицы маппингов")
         create_id_mappings(pg_conn, id_mapper)
 
-        # Обработка данных
+        # Обработка данных: каждый шаг — отдельный этап метрик process:<таблица>, как в final_script.py
         logger.info("Этап 3: Обработка и перенос в основную схему")
         process_staging_data(pg_conn, id_mapper)
 
@@ -741,6 +664,7 @@ def main():
         if 'sqlite_conn' in locals():
             sqlite_conn.close()
             logger.info("Соединение с SQLite закрыто")
+        metrics.write_summary(METRICS_PATH)
 
 
 if __name__ == "__main__":
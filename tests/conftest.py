@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Скрипты миграции лежат в корне репозитория и импортируются как модули верхнего уровня
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
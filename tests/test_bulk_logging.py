@@ -0,0 +1,41 @@
+import logging
+
+from bulk_logging import EventSampler
+
+logger = logging.getLogger('test_bulk_logging')
+
+
+def test_sampler_counts_and_limits_samples(caplog):
+    sampler = EventSampler(logger, bulk=True, sample_limit=2)
+    with caplog.at_level(logging.DEBUG, logger='test_bulk_logging'):
+        for i in range(5):
+            sampler.record('projects', 'mapping', "Маппинг %s -> %s", i, i + 100)
+        sampler.record('changes', 'mapping', "Маппинг %s -> %s", 7, 8)
+        assert caplog.records == []
+        sampler.flush()
+    messages = [record.getMessage() for record in caplog.records]
+    assert messages == [
+        "'changes' mapping: 1 событий, примеры: Маппинг 7 -> 8",
+        "'projects' mapping: 5 событий, примеры: Маппинг 0 -> 100; Маппинг 1 -> 101",
+    ]
+    assert all(record.levelno == logging.INFO for record in caplog.records)
+
+
+def test_sampler_flush_resets_counters(caplog):
+    sampler = EventSampler(logger, bulk=True, sample_limit=2)
+    sampler.record('projects', 'mapping', "Маппинг %s", 1)
+    sampler.flush()
+    caplog.clear()
+    with caplog.at_level(logging.DEBUG, logger='test_bulk_logging'):
+        sampler.flush()
+    assert caplog.records == []
+
+
+def test_sampler_verbose_mode_logs_each_event(caplog):
+    sampler = EventSampler(logger, bulk=False)
+    with caplog.at_level(logging.DEBUG, logger='test_bulk_logging'):
+        sampler.record('projects', 'mapping', "Маппинг %s", 1)
+        sampler.record('projects', 'mapping', "Маппинг %s", 2)
+    assert [(record.levelno, record.getMessage()) for record in caplog.records] == [
+        (logging.DEBUG, "Маппинг 1"), (logging.DEBUG, "Маппинг 2"),
+    ]
@@ -0,0 +1,41 @@
+import pytest
+
+pytest.importorskip('psycopg2')
+
+import final_script
+from final_script import IdMapper, plan_staging_tasks
+
+
+def test_plan_staging_tasks_splits_ranges(monkeypatch):
+    monkeypatch.setattr(final_script, 'STAGING_RANGE_ROWS', 10)
+    tasks = plan_staging_tasks({'changes': (1, 25), 'urgency': (1, 5), 'publishers': None})
+    changes = sorted(rowid_range for table, rowid_range in tasks if table == 'changes')
+    assert changes == [(1, 10), (11, 20), (21, 25)]
+    assert ('urgency', (1, 5)) in tasks
+    assert all(table != 'publishers' for table, _ in tasks)
+
+
+def test_plan_staging_tasks_orders_largest_first(monkeypatch):
+    monkeypatch.setattr(final_script, 'STAGING_RANGE_ROWS', 100)
+    tasks = plan_staging_tasks({'urgency': (1, 5), 'changes': (101, 180), 'projects': (1, 30)})
+    assert tasks == [('changes', (101, 180)), ('projects', (1, 30)), ('urgency', (1, 5))]
+
+
+def test_plan_staging_tasks_covers_every_rowid_once(monkeypatch):
+    monkeypatch.setattr(final_script, 'STAGING_RANGE_ROWS', 7)
+    tasks = plan_staging_tasks({'changes': (3, 50)})
+    covered = [rowid for _, (low, high) in tasks for rowid in range(low, high + 1)]
+    assert sorted(covered) == list(range(3, 51))
+
+
+def test_id_mapper_pending_delta():
+    id_mapper = IdMapper()
+    id_mapper.add_mapping('projects', 1, 101)
+    id_mapper.add_mapping('projects', 2, 102)
+    id_mapper.add_mapping('changes', 5, 505)
+    id_mapper.add_mapping('projects', 1, 111)
+    assert id_mapper.pending_count() == 3
+    assert sorted(id_mapper.iter_pending()) == [('changes', 5, 505), ('projects', 1, 111), ('projects', 2, 102)]
+    id_mapper.clear_pending()
+    assert id_mapper.pending_count() == 0
+    assert list(id_mapper.iter_pending()) == []
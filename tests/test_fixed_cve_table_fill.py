@@ -0,0 +1,62 @@
+import pytest
+
+pytest.importorskip('psycopg2')
+
+from fixed_cve_table_fill import extract_cve_hits, merge_cve_hits, scan_changelog
+
+VULN_MAP = {'CVE-2020-1111': 1, 'CVE-2021-22222': 2, 'CVE-2022-333333': 3}
+
+
+def test_extract_cve_hits_deduplicates_within_row():
+    rows = [
+        (10, 100, 'Fix CVE-2020-1111 and CVE-2020-1111 again, see CVE-2021-22222'),
+        (11, 100, None),
+        (12, 200, 'nothing here'),
+    ]
+    hits, min_ids = extract_cve_hits(rows)
+    assert sorted(hits) == [(10, 100, 'CVE-2020-1111'), (10, 100, 'CVE-2021-22222')]
+    assert min_ids == {100: 10, 200: 12}
+
+
+def test_merge_cve_hits_keeps_first_occurrence():
+    upsert_data, changelog_pk_map = {}, {}
+    merge_cve_hits([(5, 100, 'CVE-2020-1111')], {100: 3}, VULN_MAP, upsert_data, changelog_pk_map)
+    merge_cve_hits([(9, 100, 'CVE-2020-1111'), (9, 100, 'CVE-2099-0000')], {100: 8, 200: 7},
+                   VULN_MAP, upsert_data, changelog_pk_map)
+    assert upsert_data == {(100, 1): {'changelog_string_number': 5, 'fixed_tracker_string_number': None}}
+    assert changelog_pk_map == {100: 3, 200: 7}
+
+
+def chunked(rows, size):
+    return [rows[i:i + size] for i in range(0, len(rows), size)]
+
+
+def test_scan_changelog_parallel_matches_sequential():
+    names = list(VULN_MAP)
+    rows = [(i, i % 7, f"entry {i} {names[i % 3]}" if i % 2 else f"entry {i}") for i in range(1, 200)]
+
+    sequential_data, sequential_pk = {}, {}
+    scanned = scan_changelog(chunked(rows, 16), VULN_MAP, sequential_data, sequential_pk, workers=1)
+    parallel_data, parallel_pk = {}, {}
+    parallel_scanned = scan_changelog(chunked(rows, 16), VULN_MAP, parallel_data, parallel_pk, workers=2)
+
+    assert scanned == parallel_scanned == len(rows)
+    assert parallel_data == sequential_data
+    assert list(parallel_data) == list(sequential_data)
+    assert parallel_pk == sequential_pk
+    for (pkg_vrs, vulnerability_id), data in sequential_data.items():
+        first = min(i for i, p, text in rows if p == pkg_vrs and names[vulnerability_id - 1] in text)
+        assert data['changelog_string_number'] == first
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_scan_changelog_passes_hits_in_chunk_order(workers):
+    rows = [(i, i % 5, f"CVE-2020-{1000 + i} and CVE-2099-{1000 + i}" if i % 3 else "none") for i in range(1, 60)]
+    stored = []
+    scan_changelog(chunked(rows, 8), VULN_MAP, {}, {}, workers=workers, on_hits=stored.extend)
+
+    expected = []
+    for chunk in chunked(rows, 8):
+        expected.extend(extract_cve_hits(chunk)[0])
+    assert stored == expected
+    assert len(stored) == 2 * sum(1 for i, _, _ in rows if i % 3)
@@ -0,0 +1,25 @@
+import pytest
+
+from stage_metrics import StageMetrics, encoded_len
+
+
+def test_encoded_len_counts_utf8_bytes():
+    assert encoded_len('abc') == 3
+    assert encoded_len('тест') == 8
+    assert encoded_len(b'\x00\x01') == 2
+
+
+def test_stage_accumulates_calls_and_errors():
+    metrics = StageMetrics('test')
+    with metrics.stage('load') as stage:
+        stage['rows'] = 3
+        metrics.count_statement('SELECT 1')
+    with pytest.raises(RuntimeError):
+        with metrics.stage('load') as stage:
+            stage['rows'] = 2
+            raise RuntimeError('boom')
+    record = metrics.stages['load']
+    assert (record['calls'], record['errors'], record['rows']) == (2, 1, 5)
+    assert (record['round_trips'], record['bytes_sent']) == (1, len('SELECT 1'))
+    summary = metrics.summary()
+    assert [stage['stage'] for stage in summary['stages']] == ['load']
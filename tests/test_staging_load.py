@@ -0,0 +1,47 @@
+import sqlite3
+
+from staging_load import CopyRowStream, copy_format_value, iter_sqlite_chunks
+
+
+def test_copy_format_value_escapes_special_characters():
+    assert copy_format_value('a\tb\nc\\d\re') == 'a\\tb\\nc\\\\d\\re'
+
+
+def test_copy_format_value_null_and_types():
+    assert copy_format_value(None) == '\\N'
+    assert copy_format_value('') == ''
+    assert copy_format_value(42) == '42'
+    assert copy_format_value('\\N') == '\\\\N'
+    assert copy_format_value('тест'.encode('utf-8')) == 'тест'
+
+
+def test_copy_row_stream_formats_rows():
+    stream = CopyRowStream([(1, 'a\tb', None), (2, 'c\nd', 'e\\f')])
+    assert stream.read() == '1\ta\\tb\t\\N\n2\tc\\nd\te\\\\f\n'
+    assert stream.read() == ''
+    assert stream.row_count == 2
+
+
+def test_copy_row_stream_reads_whole_rows_in_chunks():
+    rows = [(i, f"name-{i}") for i in range(100)]
+    stream = CopyRowStream(rows)
+    chunks = []
+    while True:
+        chunk = stream.read(50)
+        if not chunk:
+            break
+        assert chunk.endswith('\n')
+        chunks.append(chunk)
+    assert len(chunks) > 1
+    assert ''.join(chunks) == ''.join(f"{i}\tname-{i}\n" for i in range(100))
+    assert stream.row_count == 100
+
+
+def test_iter_sqlite_chunks():
+    conn = sqlite3.connect(':memory:')
+    conn.execute("CREATE TABLE t (id INTEGER)")
+    conn.executemany("INSERT INTO t VALUES (?)", [(i,) for i in range(25)])
+    cur = conn.execute("SELECT id FROM t ORDER BY id")
+    chunks = list(iter_sqlite_chunks(cur, chunk_size=10))
+    assert [len(chunk) for chunk in chunks] == [10, 10, 5]
+    assert [row[0] for chunk in chunks for row in chunk] == list(range(25))